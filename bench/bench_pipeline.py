@@ -0,0 +1,404 @@
+"""Офлайн-бенчмарк конвейера воркера.
+
+Прогоняет worker.process_one_message() целиком без Yandex Cloud:
+SQS и S3 подменяются сервером moto, YDB - словарём в памяти, SpeechKit и
+YandexGPT - локальными HTTP-заглушками с настраиваемой задержкой. Видео
+лекций синтезируются ffmpeg нужной длительности.
+
+Каждый прогон идёт в отдельном процессе, чтобы пиковый RSS не накапливался
+между прогонами. Сервер moto и HTTP-заглушки работают в своих процессах,
+поэтому объекты S3 и отдаваемое видео не попадают в RSS воркера. Для каждой
+длительности печатается время этапов (из metrics.TaskTrace), пиковый RSS
+воркера, пиковый RSS дочерних ffmpeg и пиковый объём временных файлов.
+
+Пример:
+    pip install -r src/requirements.txt -r bench/requirements.txt
+    python bench/bench_pipeline.py --durations 60 600 1800 --stt-latency 0.5 --gpt-latency 2
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def make_video(path: str, duration: int):
+    """Синтетическая лекция: тестовая картинка и тон, прерываемый паузами."""
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"aevalsrc='0.3*sin(2*PI*440*t)*gt(mod(t,7),1)':s=44100:d={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast",
+        "-c:a", "aac",
+        "-movflags", "+faststart",
+        path,
+    ], check=True)
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _serve_stubs(media_dir: str, stt_latency: float, gpt_latency: float, conn):
+    """Процесс заглушек: отдаёт видео и отвечает за SpeechKit и YandexGPT."""
+    quiet_files = type("Handler", (SimpleHTTPRequestHandler,), {"log_message": lambda *a: None})
+    _, media_url = _serve(functools.partial(quiet_files, directory=media_dir))
+    _, stt_url = _serve(stub_handler(stt_latency, lambda body: {"result": "распознанный текст " * 20}))
+    _, gpt_url = _serve(stub_handler(gpt_latency, lambda body: {"text": "1. Тема\n- пункт\n\n" * 10}))
+    conn.send((media_url, stt_url, gpt_url))
+    threading.Event().wait()
+
+
+def start_stubs(media_dir: str, stt_latency: float, gpt_latency: float):
+    """Запускает заглушки в отдельном процессе; возвращает (процесс, ссылки)."""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve_stubs, args=(media_dir, stt_latency, gpt_latency, child), daemon=True
+    )
+    process.start()
+    return process, parent.recv()
+
+
+def start_moto():
+    """Сервер moto (S3 и SQS) в отдельном процессе; возвращает (процесс, адрес)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    else:
+        process.kill()
+        raise RuntimeError("сервер moto не запустился")
+    return process, f"http://127.0.0.1:{port}"
+
+
+def stub_handler(latency: float, payload):
+    """POST-заглушка: ждёт latency секунд и отвечает payload(body) в JSON."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            data = json.dumps(payload(body)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _FakeCompletions:
+    def __init__(self, url: str):
+        self._url = url
+
+    def configure(self, **kwargs):
+        return self
+
+    def run(self, prompt: str):
+        import requests
+
+        text = requests.post(self._url, data=prompt.encode("utf-8"), timeout=600).json()["text"]
+        alternative = type("Alternative", (), {"text": text})
+        return type("Result", (), {"alternatives": [alternative]})
+
+
+class FakeML:
+    """Заменяет YCloudML: completions идут в HTTP-заглушку, SDK-распознавания нет
+    (как и в проде, воркер уходит в REST API SpeechKit)."""
+
+    def __init__(self, gpt_url: str):
+        models = type("Models", (), {})()
+        models.completions = lambda name: _FakeCompletions(gpt_url)
+        self.models = models
+
+
+class FakeYDB:
+    def __init__(self):
+        self.tasks = {}
+        self.spans = []
+
+    def get_task_by_id(self, task_id):
+        return self.tasks.get(task_id)
+
+    def update_task(self, task_id, **fields):
+        self.tasks.setdefault(task_id, {"id": task_id}).update(fields)
+
+    def save_task_spans(self, spans):
+        self.spans.extend(spans)
+
+    def claim_task(self, task_id, owner, lease_seconds):
+        return "claimed"
+
+    def extend_lease(self, task_id, owner, lease_seconds):
+        pass
+
+    def release_task(self, task_id, owner):
+        pass
+
+
+def _read_status_kb(pid: int, field: str) -> int:
+    """Поле из /proc/<pid>/status в килобайтах; 0, если процесса уже нет."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+
+def _child_pids(pid: int):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Имя процесса в скобках может содержать пробелы
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+class ChildRSSMonitor:
+    """Периодически читает VmHWM дочерних процессов (ffmpeg) и запоминает пик.
+
+    RUSAGE_CHILDREN не годится: ребёнок после fork наследует RSS Python-процесса,
+    и ru_maxrss показывает его, а не память ffmpeg. VmHWM - пик процесса с его
+    запуска, так что теряется только рост за последний интервал перед выходом.
+    """
+
+    def __init__(self, exclude=(), interval: float = 0.05):
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        me = os.getpid()
+        while not self._stop.is_set():
+            for pid in _child_pids(me):
+                if pid not in self.exclude:
+                    self.peak_kb = max(self.peak_kb, _read_status_kb(pid, "VmHWM"))
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class TempDiskMonitor:
+    """Периодически измеряет объём каталога временных файлов и запоминает пик."""
+
+    def __init__(self, path: str, interval: float = 0.05):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _size(self):
+        total = 0
+        for entry in os.scandir(self.path):
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._size())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_single(duration: int, stt_latency: float, gpt_latency: float, streaming: bool):
+    """Один прогон в текущем процессе; возвращает словарь с результатами."""
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    media_dir = os.path.join(work_dir, "media")
+    temp_dir = os.path.join(work_dir, "tmp")
+    os.makedirs(media_dir)
+    os.makedirs(temp_dir)
+
+    video_name = "lecture_download.mp4"  # "download" в имени: воркер берёт ссылку как прямую
+    make_video(os.path.join(media_dir, video_name), duration)
+    video_size = os.path.getsize(os.path.join(media_dir, video_name))
+
+    stubs, (media_url, stt_url, gpt_url) = start_stubs(media_dir, stt_latency, gpt_latency)
+    moto, moto_url = start_moto()
+
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "BUCKET_NAME": "bench-bucket",
+        "FOLDER_ID": "bench-folder",
+        "CACHE_ENABLED": "0",
+        "STREAMING_EXTRACT": "1" if streaming else "0",
+    })
+    tempfile.tempdir = temp_dir
+    sys.path.insert(0, SRC_DIR)
+
+    import boto3
+
+    try:
+        import checkpoints
+        import clients
+        import lease
+        import metrics
+        import progress
+        import stt
+        import worker
+
+        fake_db = FakeYDB()
+        worker.get_task_by_id = fake_db.get_task_by_id
+        worker.update_task = fake_db.update_task
+        checkpoints.update_task = fake_db.update_task
+        progress.update_task = fake_db.update_task
+        worker.claim_task = fake_db.claim_task
+        worker.release_task = fake_db.release_task
+        lease.extend_lease = fake_db.extend_lease
+        stt.get_iam_token = lambda: "bench-token"
+        metrics.save_task_spans = fake_db.save_task_spans
+        stt.STT_URL = stt_url
+
+        clients._sqs = boto3.client("sqs", region_name="us-east-1", endpoint_url=moto_url)
+        clients._s3 = boto3.client("s3", region_name="us-east-1", endpoint_url=moto_url)
+        clients._ml_sdk = FakeML(gpt_url)
+        clients._s3.create_bucket(Bucket="bench-bucket")
+        os.environ["QUEUE_URL"] = clients._sqs.create_queue(QueueName="bench")["QueueUrl"]
+
+        task_id = f"bench-{duration}"
+        fake_db.tasks[task_id] = {
+            "id": task_id,
+            "title": f"Лекция {duration} с",
+            "video_url": f"{media_url}/{video_name}",
+        }
+        clients._sqs.send_message(QueueUrl=os.environ["QUEUE_URL"], MessageBody=json.dumps({"task_id": task_id}))
+
+        started = time.monotonic()
+        with TempDiskMonitor(temp_dir) as disk, ChildRSSMonitor(exclude=[stubs.pid, moto.pid]) as children:
+            result = worker.process_one_message()
+        total = time.monotonic() - started
+    finally:
+        moto.terminate()
+        stubs.terminate()
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "duration_s": duration,
+        "video_mb": round(video_size / 1024 / 1024, 2),
+        "status": result.get("status"),
+        "error": fake_db.tasks[task_id].get("error"),
+        "total_s": round(total, 3),
+        "stages": {s.stage: {"s": s.duration_ms / 1000, "bytes": s.bytes, "outcome": s.outcome} for s in fake_db.spans},
+        # ru_maxrss в Linux - в килобайтах
+        "peak_rss_mb": round(self_usage.ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(children.peak_kb / 1024, 1),
+        "peak_temp_disk_mb": round(disk.peak / 1024 / 1024, 2),
+    }
+
+
+def print_report(results):
+    stages = []
+    for r in results:
+        for stage in r["stages"]:
+            if stage not in stages:
+                stages.append(stage)
+
+    header = ["длит., с", "видео, МБ", "статус", "всего, с"] + [f"{s}, с" for s in stages] + \
+        ["RSS, МБ", "ffmpeg RSS, МБ", "temp, МБ"]
+    rows = []
+    for r in results:
+        rows.append(
+            [r["duration_s"], r["video_mb"], r["status"], r["total_s"]]
+            + [r["stages"].get(s, {}).get("s", "-") for s in stages]
+            + [r["peak_rss_mb"], r["peak_child_rss_mb"], r["peak_temp_disk_mb"]]
+        )
+
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(x).rjust(w) for x, w in zip(row, widths)))
+    for r in results:
+        if r["error"]:
+            print(f"{r['duration_s']} с: ошибка: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=int, nargs="+", default=[60, 600, 1800], help="длительности лекций, с")
+    parser.add_argument("--stt-latency", type=float, default=0.5, help="задержка заглушки SpeechKit на кусок, с")
+    parser.add_argument("--gpt-latency", type=float, default=2.0, help="задержка заглушки YandexGPT на запрос, с")
+    parser.add_argument("--no-streaming", action="store_true", help="скачивать видео целиком (STREAMING_EXTRACT=0)")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        result = run_single(args.single, args.stt_latency, args.gpt_latency, not args.no_streaming)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    results = []
+    for duration in args.durations:
+        cmd = [
+            sys.executable, os.path.abspath(__file__),
+            "--single", str(duration),
+            "--stt-latency", str(args.stt_latency),
+            "--gpt-latency", str(args.gpt_latency),
+        ]
+        if args.no_streaming:
+            cmd.append("--no-streaming")
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import hashlib
+
+from clients import get_http, get_s3
+from db import (
+    logger,
+    get_cache_entry,
+    save_cache_entry,
+    touch_cache_entry,
+    get_cache_total_size,
+    list_cache_eviction_candidates,
+    delete_cache_entries,
+)
+
+# Кэш результатов по отпечатку видео: повторная отправка той же лекции
+# не скачивает видео и не вызывает STT/GPT, а ссылается на готовый PDF.
+
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(1024 ** 3)))
+CACHE_PREFIX = "cache"
+
+
+def source_fingerprint(video_url: str, download_url: str):
+    """Отпечаток по заголовкам ответа (ETag / Content-Length) без скачивания файла.
+
+    Ссылки на скачивание Яндекс Диска подписаны и меняются от запроса к
+    запросу, поэтому в отпечаток идёт ETag (хэш содержимого), а если его нет -
+    исходная публичная ссылка вместе с размером. Возвращает None, если сервер
+    не отдал ни того, ни другого.
+    """
+    try:
+        response = get_http().get(download_url, stream=True, timeout=10)
+        try:
+            response.raise_for_status()
+            etag = response.headers.get("ETag", "").strip('"')
+            length = response.headers.get("Content-Length", "")
+        finally:
+            response.close()
+    except Exception as e:
+        logger.warning(f"Не удалось получить заголовки для отпечатка: {e}")
+        return None
+
+    if etag:
+        source = f"etag:{etag}:{length}"
+    elif length:
+        source = f"url:{video_url}:{length}"
+    else:
+        return None
+
+    return "video:" + hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def audio_fingerprint(audio_path: str) -> str:
+    """Отпечаток по содержимому извлечённого аудио."""
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return "audio:" + digest.hexdigest()
+
+
+def lookup(fingerprint):
+    """Возвращает запись кэша, если она не просрочена и PDF ещё существует."""
+    if not CACHE_ENABLED or not fingerprint:
+        return None
+
+    try:
+        entry = get_cache_entry(fingerprint, CACHE_TTL_SECONDS)
+        if not entry:
+            return None
+
+        get_s3().head_object(Bucket=os.environ["BUCKET_NAME"], Key=entry["pdf_object_key"])
+        touch_cache_entry(fingerprint)
+        logger.info(f"Найден результат в кэше: {fingerprint}")
+        return entry
+    except Exception as e:
+        logger.warning(f"Ошибка чтения кэша {fingerprint}: {e}")
+        return None
+
+
+def store(fingerprint, transcript: str, notes: str, pdf_object_key: str):
+    """Сохраняет транскрипт и конспект в Object Storage, а ссылки на них - в YDB."""
+    if not CACHE_ENABLED or not fingerprint:
+        return
+
+    try:
+        s3 = get_s3()
+        bucket = os.environ["BUCKET_NAME"]
+        transcript_key = f"{CACHE_PREFIX}/{fingerprint}/transcript.txt"
+        notes_key = f"{CACHE_PREFIX}/{fingerprint}/notes.txt"
+
+        transcript_bytes = transcript.encode("utf-8")
+        notes_bytes = notes.encode("utf-8")
+        s3.put_object(Bucket=bucket, Key=transcript_key, Body=transcript_bytes, ContentType="text/plain; charset=utf-8")
+        s3.put_object(Bucket=bucket, Key=notes_key, Body=notes_bytes, ContentType="text/plain; charset=utf-8")
+
+        save_cache_entry(fingerprint, transcript_key, notes_key, pdf_object_key, len(transcript_bytes) + len(notes_bytes))
+        logger.info(f"Результат сохранён в кэш: {fingerprint}")
+
+        evict()
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить результат в кэш: {e}")
+
+
+def evict():
+    """Удаляет просроченные записи и самые старые, пока кэш больше CACHE_MAX_BYTES.
+
+    PDF принадлежит заданию и не удаляется, удаляются только транскрипт и конспект.
+    """
+    total = get_cache_total_size()
+    victims = []
+    for entry in list_cache_eviction_candidates(CACHE_TTL_SECONDS):
+        if not entry["expired"] and total <= CACHE_MAX_BYTES:
+            break
+        victims.append(entry)
+        total -= entry["size_bytes"] or 0
+
+    if not victims:
+        return
+
+    s3 = get_s3()
+    bucket = os.environ["BUCKET_NAME"]
+    s3.delete_objects(
+        Bucket=bucket,
+        Delete={
+            "Objects": [{"Key": e[k]} for e in victims for k in ("transcript_key", "notes_key")],
+            "Quiet": True,
+        },
+    )
+    delete_cache_entries([e["fingerprint"] for e in victims])
+    logger.info(f"Из кэша удалено записей: {len(victims)}")
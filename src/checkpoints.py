@@ -0,0 +1,77 @@
+import os
+
+from clients import get_s3
+from db import logger, update_task
+
+# Результаты этапов сохраняются в Object Storage, а достигнутый этап - в
+# колонке tasks.stage. Повторная доставка сообщения продолжает обработку с
+# последнего завершённого этапа, не платя заново за STT и GPT.
+
+STAGES = ["audio", "transcript", "notes", "pdf"]
+
+CHECKPOINT_PREFIX = "checkpoints"
+# Аудио лекции весит сотни мегабайт; его сохранение можно отключить,
+# тогда при повторе видео скачивается заново
+CHECKPOINT_AUDIO = os.environ.get("CHECKPOINT_AUDIO", "1") == "1"
+
+_TEXT_STAGES = {"transcript": "transcript.txt", "notes": "notes.txt"}
+
+
+def reached(task_stage, stage: str) -> bool:
+    """Пройден ли этап stage, если последний завершённый этап - task_stage."""
+    if task_stage not in STAGES:
+        return False
+    return STAGES.index(task_stage) >= STAGES.index(stage)
+
+
+def _key(task_id: str, name: str) -> str:
+    return f"{CHECKPOINT_PREFIX}/{task_id}/{name}"
+
+
+def save_audio(task_id: str, audio_path: str):
+    if not CHECKPOINT_AUDIO:
+        return
+    # Чекпоинт - оптимизация: его ошибка не должна ронять задание
+    try:
+        get_s3().upload_file(audio_path, os.environ["BUCKET_NAME"], _key(task_id, "audio.wav"))
+        update_task(task_id, stage="audio")
+        logger.info(f"Чекпоинт {task_id}: audio")
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить чекпоинт audio для {task_id}: {e}")
+
+
+def load_audio(task_id: str, audio_path: str):
+    get_s3().download_file(os.environ["BUCKET_NAME"], _key(task_id, "audio.wav"), audio_path)
+
+
+def save_text(task_id: str, stage: str, text: str):
+    try:
+        get_s3().put_object(
+            Bucket=os.environ["BUCKET_NAME"],
+            Key=_key(task_id, _TEXT_STAGES[stage]),
+            Body=text.encode("utf-8"),
+            ContentType="text/plain; charset=utf-8",
+        )
+        update_task(task_id, stage=stage)
+        logger.info(f"Чекпоинт {task_id}: {stage}")
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить чекпоинт {stage} для {task_id}: {e}")
+
+
+def load_text(task_id: str, stage: str) -> str:
+    obj = get_s3().get_object(Bucket=os.environ["BUCKET_NAME"], Key=_key(task_id, _TEXT_STAGES[stage]))
+    return obj["Body"].read().decode("utf-8")
+
+
+def cleanup(task_id: str):
+    """Удаляет промежуточные результаты, когда задание завершено успешно или окончательно с ошибкой."""
+    try:
+        get_s3().delete_objects(
+            Bucket=os.environ["BUCKET_NAME"],
+            Delete={
+                "Objects": [{"Key": _key(task_id, name)} for name in ["audio.wav", *_TEXT_STAGES.values()]],
+                "Quiet": True,
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось удалить чекпоинты {task_id}: {e}")
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import threading
+
+import boto3
+import requests
+from botocore.client import Config
+from requests.adapters import HTTPAdapter
+
+from db import logger
+from ttl_cache import TTLCache
+
+# Клиенты создаются один раз на процесс и переиспользуются между запросами:
+# на прогретом контейнере не тратим время на создание клиента и TLS-рукопожатие.
+
+MAX_POOL_CONNECTIONS = int(os.environ.get("MAX_POOL_CONNECTIONS", "20"))
+# IAM-токен живёт часы; обновляем его заранее, не дожидаясь истечения
+IAM_REFRESH_MARGIN_SECONDS = 300
+
+_lock = threading.Lock()
+_sqs = None
+_s3 = None
+_ml_sdk = None
+_http = None
+
+_iam_lock = threading.Lock()
+_iam_tokens = TTLCache(0, maxsize=1)
+
+_async_lock = None
+_sqs_async = None
+
+
+def _boto_config(**kwargs):
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "standard"},
+        **kwargs,
+    )
+
+
+def get_sqs():
+    global _sqs
+
+    if _sqs is None:
+        with _lock:
+            if _sqs is None:
+                _sqs = boto3.session.Session().client(
+                    service_name='sqs',
+                    endpoint_url='https://message-queue.api.cloud.yandex.net',
+                    region_name='ru-central1',
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                    config=_boto_config(),
+                )
+                logger.info("SQS client created")
+
+    return _sqs
+
+
+def get_s3():
+    global _s3
+
+    if _s3 is None:
+        with _lock:
+            if _s3 is None:
+                _s3 = boto3.session.Session().client(
+                    service_name='s3',
+                    endpoint_url='https://storage.yandexcloud.net',
+                    region_name='ru-central1',
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                    config=_boto_config(signature_version='s3v4'),
+                )
+                logger.info("S3 client created")
+
+    return _s3
+
+
+def get_ml_sdk():
+    global _ml_sdk
+
+    if _ml_sdk is None:
+        with _lock:
+            if _ml_sdk is None:
+                # Импорт здесь, чтобы web-контейнер не тянул SDK без необходимости
+                from yandex_cloud_ml_sdk import YCloudML
+
+                _ml_sdk = YCloudML(folder_id=os.environ.get("FOLDER_ID"))
+                logger.info("YCloudML SDK created")
+
+    return _ml_sdk
+
+
+def get_http():
+    """Общая HTTP-сессия с пулом keep-alive соединений."""
+    global _http
+
+    if _http is None:
+        with _lock:
+            if _http is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MAX_POOL_CONNECTIONS, pool_maxsize=MAX_POOL_CONNECTIONS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http = session
+                logger.info("HTTP session created")
+
+    return _http
+
+
+def get_iam_token():
+    """IAM-токен сервисного аккаунта из метаданных, кэшируется до скорого истечения."""
+    token = _iam_tokens.get("iam")
+    if token:
+        return token
+
+    with _iam_lock:
+        token = _iam_tokens.get("iam")
+        if token:
+            return token
+
+        response = get_http().get(
+            "http://169.254.169.254/computeMetadata/v1/instance/service-accounts/default/token",
+            headers={"Metadata-Flavor": "Google"},
+            timeout=10,
+        )
+        response.raise_for_status()
+        data = response.json()
+        token = data["access_token"]
+        ttl = max(0, int(data.get("expires_in", 0)) - IAM_REFRESH_MARGIN_SECONDS)
+        _iam_tokens.set("iam", token, ttl)
+        logger.info(f"IAM token received, cached for {ttl} s")
+        return token
+
+
+async def get_sqs_async():
+    """Асинхронный SQS-клиент (aiobotocore), живёт всё время работы процесса."""
+    global _async_lock, _sqs_async
+
+    if _sqs_async is not None:
+        return _sqs_async
+
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+
+    async with _async_lock:
+        if _sqs_async is None:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+
+            creator = get_session().create_client(
+                'sqs',
+                endpoint_url='https://message-queue.api.cloud.yandex.net',
+                region_name='ru-central1',
+                aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                config=AioConfig(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                ),
+            )
+            _sqs_async = await creator.__aenter__()
+            logger.info("Async SQS client created")
+
+    return _sqs_async
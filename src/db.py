@@ -1,23 +1,43 @@
 import ydb
+import ydb.aio
+import ydb.aio.iam
+import asyncio
 import logging
+import threading
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
+YDB_ENDPOINT = "grpcs://ydb.serverless.yandexcloud.net:2135"
+YDB_DATABASE = "/ru-central1/b1g71e95h51okii30p25/etnj66mb9sl4kck50v6t"
+
+_lock = threading.Lock()
 _driver = None
 _pool = None
 
+# Асинхронные драйвер и пул для web-обработчиков
+_async_lock = None
+_async_driver = None
+_async_pool = None
+
 
 def _get_driver():
     global _driver
 
-    if _driver is None:
+    if _driver is not None:
+        return _driver
+
+    with _lock:
+        if _driver is not None:
+            return _driver
         try:
-            _driver = ydb.Driver(
-                endpoint="grpcs://ydb.serverless.yandexcloud.net:2135",
-                database="/ru-central1/b1g71e95h51okii30p25/etnj66mb9sl4kck50v6t",
+            driver = ydb.Driver(
+                endpoint=YDB_ENDPOINT,
+                database=YDB_DATABASE,
                 credentials=ydb.iam.MetadataUrlCredentials(),
             )
-            _driver.wait(fail_fast=True, timeout=40)
+            driver.wait(fail_fast=True, timeout=40)
+            _driver = driver
             logger.info("YDB driver initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize YDB driver: {e}")
@@ -31,103 +51,613 @@ def _get_pool():
 
     if _pool is None:
         driver = _get_driver()
-        _pool = ydb.SessionPool(driver)
-        logger.info("YDB session pool created")
+        with _lock:
+            if _pool is None:
+                _pool = ydb.SessionPool(driver)
+                logger.info("YDB session pool created")
 
     return _pool
 
 
-def save_task(task_id, title, video_url):
+async def _get_async_pool():
+    global _async_lock, _async_driver, _async_pool
+
+    if _async_pool is not None:
+        return _async_pool
+
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+
+    async with _async_lock:
+        if _async_pool is None:
+            try:
+                driver = ydb.aio.Driver(
+                    endpoint=YDB_ENDPOINT,
+                    database=YDB_DATABASE,
+                    credentials=ydb.aio.iam.MetadataUrlCredentials(),
+                )
+                await driver.wait(fail_fast=True, timeout=40)
+                _async_driver = driver
+                _async_pool = ydb.aio.SessionPool(driver, size=50)
+                logger.info("YDB async session pool created")
+            except Exception as e:
+                logger.error(f"Failed to initialize async YDB driver: {e}")
+                raise
+
+    return _async_pool
+
+
+def _execute(session, query, params=None, commit_tx=True):
+    """Выполняет параметризованный запрос.
+
+    session.prepare() кэширует скомпилированный запрос в сессии, поэтому
+    текст запроса компилируется один раз на сессию, а меняются только
+    типизированные параметры.
+    """
+    prepared = session.prepare(query)
+    return session.transaction(ydb.SerializableReadWrite()).execute(
+        prepared,
+        params or {},
+        commit_tx=commit_tx,
+    )
+
+
+async def _execute_async(session, query, params=None, commit_tx=True):
+    prepared = await session.prepare(query)
+    return await session.transaction(ydb.SerializableReadWrite()).execute(
+        prepared,
+        params or {},
+        commit_tx=commit_tx,
+    )
+
+
+# Типы колонок, которые можно менять через update_task
+_TASK_COLUMN_TYPES = {
+    "status": "Utf8",
+    "pdf_object_key": "Utf8",
+    "error": "Utf8",
+    "stage": "Utf8",
+    "progress": "Utf8",
+    "pdf_sha256": "Utf8",
+}
+
+
+_SAVE_TASK_QUERY = """
+DECLARE $id AS Utf8;
+DECLARE $title AS Utf8;
+DECLARE $video_url AS Utf8;
+DECLARE $download_url AS Utf8?;
+DECLARE $download_url_ttl AS Int32?;
+DECLARE $duration_seconds AS Double?;
+DECLARE $audio_codec AS Utf8?;
+DECLARE $size_bytes AS Uint64?;
+DECLARE $eta_seconds AS Uint32?;
+
+INSERT INTO `tasks` (
+    id, created_at, title, video_url, status, download_url, download_url_until,
+    duration_seconds, audio_codec, size_bytes, eta_seconds
+)
+VALUES (
+    $id, CurrentUtcTimestamp(), $title, $video_url, 'В очереди',
+    $download_url, CurrentUtcTimestamp() + DateTime::IntervalFromSeconds($download_url_ttl),
+    $duration_seconds, $audio_codec, $size_bytes, $eta_seconds
+);
+"""
+
+
+def _save_task_params(task_id, title, video_url, download_url, download_url_ttl, media, eta_seconds):
+    return {
+        "$id": task_id,
+        "$title": title,
+        "$video_url": video_url,
+        "$download_url": download_url,
+        "$download_url_ttl": download_url_ttl,
+        "$duration_seconds": media.duration_seconds if media else None,
+        "$audio_codec": media.audio_codec if media else None,
+        "$size_bytes": media.size_bytes if media else None,
+        "$eta_seconds": eta_seconds,
+    }
+
+
+def save_task(task_id, title, video_url, download_url=None, download_url_ttl=None, media=None, eta_seconds=None):
     pool = _get_pool()
 
     def op(session):
         logger.info("SAVING TASK: task_id=%r title=%r video_url=%r", task_id, title, video_url)
 
-        query = f"""
-        INSERT INTO `tasks` (id, created_at, title, video_url, status)
-        VALUES ('{task_id}', CurrentUtcTimestamp(), '{title}', '{video_url}', 'В очереди');
-        """
-
-        session.transaction().execute(
-            query,
-            commit_tx=True,
-        )
+        _execute(session, _SAVE_TASK_QUERY, _save_task_params(
+            task_id, title, video_url, download_url, download_url_ttl, media, eta_seconds
+        ))
         logger.info("Task saved successfully")
 
     pool.retry_operation_sync(op)
 
 
+async def save_task_async(task_id, title, video_url, download_url=None, download_url_ttl=None,
+                          media=None, eta_seconds=None):
+    pool = await _get_async_pool()
+
+    async def op(session):
+        logger.info("SAVING TASK: task_id=%r title=%r video_url=%r", task_id, title, video_url)
+
+        await _execute_async(session, _SAVE_TASK_QUERY, _save_task_params(
+            task_id, title, video_url, download_url, download_url_ttl, media, eta_seconds
+        ))
+        logger.info("Task saved successfully")
+
+    await pool.retry_operation(op)
+
+
+_SAVE_TASKS_QUERY = """
+DECLARE $tasks AS List<Struct<id: Utf8, title: Utf8, video_url: Utf8>>;
+
+UPSERT INTO `tasks` (id, created_at, title, video_url, status)
+SELECT id, CurrentUtcTimestamp() AS created_at, title, video_url, 'В очереди' AS status
+FROM AS_TABLE($tasks);
+"""
+
+TaskRow = namedtuple("TaskRow", ["id", "title", "video_url"])
+
+
+async def save_tasks_async(tasks):
+    """Сохраняет пачку заданий (список TaskRow) одной транзакцией."""
+    pool = await _get_async_pool()
+
+    async def op(session):
+        await _execute_async(session, _SAVE_TASKS_QUERY, {"$tasks": list(tasks)})
+        logger.info(f"Saved {len(tasks)} tasks in one transaction")
+
+    await pool.retry_operation(op)
+
+
 def update_task(task_id, **fields):
     pool = _get_pool()
 
     if not fields:
         return
 
+    # Текст запроса зависит только от набора колонок, а не от значений,
+    # поэтому таких вариантов немного и все они попадают в кэш
+    columns = sorted(fields)
+    declares = ["DECLARE $id AS Utf8;"]
     set_parts = []
-    for k, v in fields.items():
-        # Экранируем кавычки
-        if isinstance(v, str):
-            v = v.replace("'", "''")
-        set_parts.append(f"{k} = '{v}'")
+    params = {"$id": task_id}
+    for k in columns:
+        if k not in _TASK_COLUMN_TYPES:
+            raise ValueError(f"Unknown task column: {k}")
+        declares.append(f"DECLARE ${k} AS {_TASK_COLUMN_TYPES[k]}?;")
+        set_parts.append(f"{k} = ${k}")
+        params[f"${k}"] = fields[k]
+
+    query = "\n".join(declares) + f"""
 
-    query = f"""
     UPDATE `tasks`
     SET {', '.join(set_parts)}
-    WHERE id = '{task_id}';
+    WHERE id = $id;
     """
 
     def op(session):
-        session.transaction().execute(query, commit_tx=True)
+        _execute(session, query, params)
 
     pool.retry_operation_sync(op)
 
 
-def list_tasks():
+TASKS_PAGE_SIZE = 50
+
+
+def _encode_cursor(row):
+    return f"{row.created_at}:{row.id}"
+
+
+def _decode_cursor(cursor):
+    created_at, _, task_id = cursor.partition(":")
+    return int(created_at), task_id
+
+
+_LIST_TASKS_QUERY = """
+DECLARE $limit AS Uint64;
+
+SELECT id, title, status, pdf_object_key, error, created_at
+FROM `tasks` VIEW idx_created_at
+ORDER BY created_at DESC, id DESC
+LIMIT $limit;
+"""
+
+_LIST_TASKS_AFTER_QUERY = """
+DECLARE $limit AS Uint64;
+DECLARE $created_at AS Timestamp;
+DECLARE $id AS Utf8;
+
+SELECT id, title, status, pdf_object_key, error, created_at
+FROM `tasks` VIEW idx_created_at
+WHERE created_at < $created_at
+   OR (created_at = $created_at AND id < $id)
+ORDER BY created_at DESC, id DESC
+LIMIT $limit;
+"""
+
+
+def _list_tasks_query(limit, cursor):
+    # Запрашиваем на одну строку больше, чтобы понять, есть ли следующая страница
+    params = {"$limit": limit + 1}
+    if not cursor:
+        return _LIST_TASKS_QUERY, params
+
+    created_at, task_id = _decode_cursor(cursor)
+    params.update({"$created_at": created_at, "$id": task_id})
+    return _LIST_TASKS_AFTER_QUERY, params
+
+
+def _page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _encode_cursor(rows[-1])
+    return rows, None
+
+
+def list_tasks(limit=TASKS_PAGE_SIZE, cursor=None):
+    """Страница заданий, от новых к старым.
+
+    Keyset-пагинация по (created_at, id) через покрывающий индекс
+    idx_created_at: время ответа не зависит от размера таблицы. Возвращает
+    строки страницы и курсор следующей страницы (None, если она последняя).
+    """
     pool = _get_pool()
+    query, params = _list_tasks_query(limit, cursor)
 
     def op(session):
-        res = session.transaction().execute(
-            "SELECT * FROM `tasks` ORDER BY created_at DESC;",
-            commit_tx=True,
-        )
+        res = _execute(session, query, params)
         return res[0].rows
 
-    return pool.retry_operation_sync(op)
+    rows = pool.retry_operation_sync(op)
+    return _page(rows, limit)
+
+
+async def list_tasks_async(limit=TASKS_PAGE_SIZE, cursor=None):
+    pool = await _get_async_pool()
+    query, params = _list_tasks_query(limit, cursor)
+
+    async def op(session):
+        res = await _execute_async(session, query, params)
+        return res[0].rows
+
+    rows = await pool.retry_operation(op)
+    return _page(rows, limit)
+
+
+_GET_TASK_URL_QUERY = """
+DECLARE $id AS Utf8;
+
+SELECT video_url FROM `tasks`
+WHERE id = $id;
+"""
+
 
 def get_task_url_by_id(task_id):
     pool = _get_pool()
 
     def op(session):
-        query = f"""
-        SELECT video_url FROM `tasks` 
-        WHERE id = '{task_id}';
-        """
-        res = session.transaction().execute(query, commit_tx=True)
+        res = _execute(session, _GET_TASK_URL_QUERY, {"$id": task_id})
         return res[0].rows[0] if res[0].rows else None
 
     return pool.retry_operation_sync(op)
 
 
+_GET_TASK_QUERY = """
+DECLARE $id AS Utf8;
+
+SELECT id, title, video_url, status, pdf_object_key, error, stage, progress, created_at,
+    duration_seconds, audio_codec, size_bytes, eta_seconds,
+    -- Разрешённая при создании ссылка отдаётся, только пока не истекла
+    IF(COALESCE(download_url_until > CurrentUtcTimestamp(), false), download_url, NULL) AS download_url
+FROM `tasks`
+WHERE id = $id;
+"""
+
+
+def _task_from_row(row):
+    return {
+        "id": row.id,
+        "title": row.title,
+        "video_url": row.video_url,
+        "status": row.status,
+        "pdf_object_key": getattr(row, 'pdf_object_key', None),
+        "error": getattr(row, 'error', None),
+        "stage": getattr(row, 'stage', None),
+        "progress": getattr(row, 'progress', None),
+        "download_url": getattr(row, 'download_url', None),
+        "duration_seconds": getattr(row, 'duration_seconds', None),
+        "audio_codec": getattr(row, 'audio_codec', None),
+        "size_bytes": getattr(row, 'size_bytes', None),
+        "eta_seconds": getattr(row, 'eta_seconds', None),
+    }
+
+
 def get_task_by_id(task_id):
     pool = _get_pool()
 
     def op(session):
-        query = f"""
-        SELECT id, title, video_url, status, pdf_object_key, error, created_at
-        FROM `tasks` 
-        WHERE id = '{task_id}';
-        """
-        res = session.transaction().execute(query, commit_tx=True)
+        res = _execute(session, _GET_TASK_QUERY, {"$id": task_id})
+        if res[0].rows:
+            return _task_from_row(res[0].rows[0])
+        return None
+
+    return pool.retry_operation_sync(op)
+
+
+async def get_task_by_id_async(task_id):
+    pool = await _get_async_pool()
+
+    async def op(session):
+        res = await _execute_async(session, _GET_TASK_QUERY, {"$id": task_id})
+        if res[0].rows:
+            return _task_from_row(res[0].rows[0])
+        return None
+
+    return await pool.retry_operation(op)
+
+
+_GET_CACHE_ENTRY_QUERY = """
+DECLARE $fingerprint AS Utf8;
+DECLARE $ttl AS Int32;
+
+SELECT fingerprint, transcript_key, notes_key, pdf_object_key, size_bytes
+FROM `cache`
+WHERE fingerprint = $fingerprint
+  AND created_at > CurrentUtcTimestamp() - DateTime::IntervalFromSeconds($ttl);
+"""
+
+
+def get_cache_entry(fingerprint, ttl_seconds):
+    pool = _get_pool()
+
+    def op(session):
+        res = _execute(session, _GET_CACHE_ENTRY_QUERY, {
+            "$fingerprint": fingerprint,
+            "$ttl": int(ttl_seconds),
+        })
         if res[0].rows:
             row = res[0].rows[0]
             return {
-                "id": row.id,
-                "title": row.title,
-                "video_url": row.video_url,
-                "status": row.status,
-                "pdf_object_key": getattr(row, 'pdf_object_key', None),
-                "error": getattr(row, 'error', None),
+                "fingerprint": row.fingerprint,
+                "transcript_key": row.transcript_key,
+                "notes_key": row.notes_key,
+                "pdf_object_key": row.pdf_object_key,
+                "size_bytes": row.size_bytes,
             }
         return None
 
-    return pool.retry_operation_sync(op)
\ No newline at end of file
+    return pool.retry_operation_sync(op)
+
+
+_SAVE_CACHE_ENTRY_QUERY = """
+DECLARE $fingerprint AS Utf8;
+DECLARE $transcript_key AS Utf8;
+DECLARE $notes_key AS Utf8;
+DECLARE $pdf_object_key AS Utf8;
+DECLARE $size_bytes AS Uint64;
+
+UPSERT INTO `cache` (fingerprint, created_at, last_hit_at, transcript_key, notes_key, pdf_object_key, size_bytes)
+VALUES ($fingerprint, CurrentUtcTimestamp(), CurrentUtcTimestamp(),
+        $transcript_key, $notes_key, $pdf_object_key, $size_bytes);
+"""
+
+
+def save_cache_entry(fingerprint, transcript_key, notes_key, pdf_object_key, size_bytes):
+    pool = _get_pool()
+
+    def op(session):
+        _execute(session, _SAVE_CACHE_ENTRY_QUERY, {
+            "$fingerprint": fingerprint,
+            "$transcript_key": transcript_key,
+            "$notes_key": notes_key,
+            "$pdf_object_key": pdf_object_key,
+            "$size_bytes": int(size_bytes),
+        })
+
+    pool.retry_operation_sync(op)
+
+
+_TOUCH_CACHE_ENTRY_QUERY = """
+DECLARE $fingerprint AS Utf8;
+
+UPDATE `cache`
+SET last_hit_at = CurrentUtcTimestamp()
+WHERE fingerprint = $fingerprint;
+"""
+
+
+def touch_cache_entry(fingerprint):
+    pool = _get_pool()
+
+    def op(session):
+        _execute(session, _TOUCH_CACHE_ENTRY_QUERY, {"$fingerprint": fingerprint})
+
+    pool.retry_operation_sync(op)
+
+
+def get_cache_total_size():
+    pool = _get_pool()
+
+    def op(session):
+        res = _execute(session, "SELECT SUM(size_bytes) AS total FROM `cache`;")
+        return res[0].rows[0].total or 0
+
+    return pool.retry_operation_sync(op)
+
+
+_CACHE_EVICTION_CANDIDATES_QUERY = """
+DECLARE $ttl AS Int32;
+DECLARE $limit AS Uint64;
+
+SELECT fingerprint, transcript_key, notes_key, size_bytes,
+       created_at <= CurrentUtcTimestamp() - DateTime::IntervalFromSeconds($ttl) AS expired
+FROM `cache`
+ORDER BY expired DESC, last_hit_at
+LIMIT $limit;
+"""
+
+
+def list_cache_eviction_candidates(ttl_seconds, limit=100):
+    """Сначала просроченные записи, затем самые давно использованные."""
+    pool = _get_pool()
+
+    def op(session):
+        res = _execute(session, _CACHE_EVICTION_CANDIDATES_QUERY, {
+            "$ttl": int(ttl_seconds),
+            "$limit": int(limit),
+        })
+        return [
+            {
+                "fingerprint": row.fingerprint,
+                "transcript_key": row.transcript_key,
+                "notes_key": row.notes_key,
+                "size_bytes": row.size_bytes,
+                "expired": row.expired,
+            }
+            for row in res[0].rows
+        ]
+
+    return pool.retry_operation_sync(op)
+
+
+_DELETE_CACHE_ENTRIES_QUERY = """
+DECLARE $fingerprints AS List<Utf8>;
+
+DELETE FROM `cache`
+WHERE fingerprint IN $fingerprints;
+"""
+
+
+def delete_cache_entries(fingerprints):
+    pool = _get_pool()
+
+    if not fingerprints:
+        return
+
+    def op(session):
+        _execute(session, _DELETE_CACHE_ENTRIES_QUERY, {"$fingerprints": list(fingerprints)})
+
+    pool.retry_operation_sync(op)
+
+
+_SAVE_TASK_SPANS_QUERY = """
+DECLARE $spans AS List<Struct<task_id: Utf8, attempt: Uint32, seq: Uint32, stage: Utf8, duration_ms: Uint64, bytes: Uint64, outcome: Utf8>>;
+
+UPSERT INTO `task_spans` (task_id, attempt, seq, created_at, stage, duration_ms, bytes, outcome)
+SELECT task_id, attempt, seq, CurrentUtcTimestamp() AS created_at, stage, duration_ms, bytes, outcome
+FROM AS_TABLE($spans);
+"""
+
+SpanRow = namedtuple("SpanRow", ["task_id", "attempt", "seq", "stage", "duration_ms", "bytes", "outcome"])
+
+
+def save_task_spans(spans):
+    """Сохраняет этапы обработки задания (список SpanRow) одним запросом."""
+    pool = _get_pool()
+
+    if not spans:
+        return
+
+    def op(session):
+        _execute(session, _SAVE_TASK_SPANS_QUERY, {"$spans": list(spans)})
+
+    pool.retry_operation_sync(op)
+
+
+_GET_LEASE_QUERY = """
+DECLARE $id AS Utf8;
+
+SELECT status, lease_owner, lease_until > CurrentUtcTimestamp() AS lease_active
+FROM `tasks`
+WHERE id = $id;
+"""
+
+_SET_LEASE_QUERY = """
+DECLARE $id AS Utf8;
+DECLARE $owner AS Utf8;
+DECLARE $lease AS Int32;
+
+UPDATE `tasks`
+SET lease_owner = $owner,
+    lease_until = CurrentUtcTimestamp() + DateTime::IntervalFromSeconds($lease)
+WHERE id = $id;
+"""
+
+
+def claim_task(task_id, owner, lease_seconds):
+    """Захватывает задание на lease_seconds секунд.
+
+    Возвращает "claimed", "busy" (задание держит другой живой воркер),
+    "done" (уже успешно завершено) или "missing". Чтение и запись идут в
+    одной serializable-транзакции: из двух конкурентов коммит пройдёт у
+    одного, второй повторит операцию и увидит чужую аренду.
+    """
+    pool = _get_pool()
+
+    def op(session):
+        tx = session.transaction(ydb.SerializableReadWrite()).begin()
+        res = tx.execute(session.prepare(_GET_LEASE_QUERY), {"$id": task_id})
+        if not res[0].rows:
+            tx.rollback()
+            return "missing"
+
+        row = res[0].rows[0]
+        if row.status == "Успешно завершено":
+            tx.rollback()
+            return "done"
+        if row.lease_owner and row.lease_owner != owner and row.lease_active:
+            tx.rollback()
+            return "busy"
+
+        tx.execute(
+            session.prepare(_SET_LEASE_QUERY),
+            {"$id": task_id, "$owner": owner, "$lease": int(lease_seconds)},
+            commit_tx=True,
+        )
+        return "claimed"
+
+    return pool.retry_operation_sync(op)
+
+
+_EXTEND_LEASE_QUERY = """
+DECLARE $id AS Utf8;
+DECLARE $owner AS Utf8;
+DECLARE $lease AS Int32;
+
+UPDATE `tasks`
+SET lease_until = CurrentUtcTimestamp() + DateTime::IntervalFromSeconds($lease)
+WHERE id = $id AND lease_owner = $owner;
+"""
+
+
+def extend_lease(task_id, owner, lease_seconds):
+    pool = _get_pool()
+
+    def op(session):
+        _execute(session, _EXTEND_LEASE_QUERY, {
+            "$id": task_id,
+            "$owner": owner,
+            "$lease": int(lease_seconds),
+        })
+
+    pool.retry_operation_sync(op)
+
+
+_RELEASE_LEASE_QUERY = """
+DECLARE $id AS Utf8;
+DECLARE $owner AS Utf8;
+
+UPDATE `tasks`
+SET lease_owner = NULL, lease_until = NULL
+WHERE id = $id AND lease_owner = $owner;
+"""
+
+
+def release_task(task_id, owner):
+    pool = _get_pool()
+
+    def op(session):
+        _execute(session, _RELEASE_LEASE_QUERY, {"$id": task_id, "$owner": owner})
+
+    pool.retry_operation_sync(op)
@@ -0,0 +1,162 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from clients import get_http
+from db import logger
+
+# Скорость одного соединения с Яндекс Диском ограничена, поэтому большие
+# файлы качаются параллельными Range-запросами прямо в нужные места
+# заранее выделенного файла. Если сервер не поддерживает Range, файл
+# качается одним потоком.
+
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "8"))
+DOWNLOAD_SEGMENT_BYTES = int(os.environ.get("DOWNLOAD_SEGMENT_MB", "16")) * 1024 * 1024
+# Файлы меньше этого размера быстрее скачать одним запросом
+PARALLEL_MIN_BYTES = int(os.environ.get("DOWNLOAD_PARALLEL_MIN_MB", "32")) * 1024 * 1024
+DOWNLOAD_RETRIES = 3
+READ_CHUNK_BYTES = 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+)")
+
+
+def _check_content_type(response):
+    content_type = response.headers.get('Content-Type', '')
+    logger.info(f"Content-Type: {content_type}")
+    if 'text/html' in content_type:
+        raise Exception(f"URL вернул HTML вместо видео. Возможно, это не прямая ссылка на файл.")
+
+
+def _write_stream(response, output_path: str, on_progress=None) -> int:
+    expected = int(response.headers.get("Content-Length", 0))
+    total_size = 0
+    with open(output_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+            if chunk:
+                f.write(chunk)
+                total_size += len(chunk)
+                if on_progress and expected:
+                    on_progress(total_size, expected)
+    return total_size
+
+
+def _fetch_segment(url: str, fd: int, start: int, end: int, on_bytes=None, stop=None):
+    """Качает байты [start, end] в fd; при обрыве докачивает только остаток.
+
+    Если установлен stop, сегмент бросается недокачанным: скачивание
+    целиком уже не удалось из-за другого сегмента.
+    """
+    pos = start
+    last_error = None
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        if stop and stop.is_set():
+            return
+        try:
+            with get_http().get(url, headers={"Range": f"bytes={pos}-{end}"}, stream=True, timeout=60) as response:
+                if response.status_code != 206:
+                    raise Exception(f"сервер ответил {response.status_code} на Range-запрос")
+                for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+                    if stop and stop.is_set():
+                        return
+                    if chunk:
+                        os.pwrite(fd, chunk, pos)
+                        pos += len(chunk)
+                        if on_bytes:
+                            on_bytes(len(chunk))
+            if pos > end:
+                return
+            raise Exception(f"получено {pos - start} из {end - start + 1} байт")
+        except Exception as e:
+            last_error = e
+            logger.warning(f"Сегмент {start}-{end}, попытка {attempt + 1}: {e}")
+    raise Exception(f"Не удалось скачать сегмент {start}-{end}: {last_error}")
+
+
+def _download_parallel(url: str, output_path: str, size: int, on_progress=None):
+    segments = [
+        (start, min(start + DOWNLOAD_SEGMENT_BYTES, size) - 1)
+        for start in range(0, size, DOWNLOAD_SEGMENT_BYTES)
+    ]
+    logger.info(f"Параллельное скачивание: {len(segments)} сегментов, {DOWNLOAD_CONNECTIONS} соединений")
+
+    lock = threading.Lock()
+    done = 0
+
+    def on_bytes(n):
+        nonlocal done
+        with lock:
+            done += n
+            current = done
+        if on_progress:
+            on_progress(current, size)
+
+    fd = os.open(output_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # Место выделяется сразу: нехватка диска обнаружится до скачивания
+        os.posix_fallocate(fd, 0, size)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=min(DOWNLOAD_CONNECTIONS, len(segments))) as pool:
+            futures = [pool.submit(_fetch_segment, url, fd, start, end, on_bytes, stop) for start, end in segments]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # Сегмент не скачался за все попытки: остальные не ждём,
+                # ещё не начатые отменяем, идущие прервутся на следующем куске
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        os.close(fd)
+
+
+def parallel_size(url: str):
+    """Размер файла, если его выгоднее качать параллельно, иначе None.
+
+    Выгоднее, когда сервер поддерживает Range, а файл не меньше
+    PARALLEL_MIN_BYTES. Проверка стоит одного запроса на первый байт.
+    """
+    if DOWNLOAD_CONNECTIONS <= 1:
+        return None
+    try:
+        with get_http().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as probe:
+            match = _CONTENT_RANGE.match(probe.headers.get("Content-Range", ""))
+            if probe.status_code != 206 or not match:
+                return None
+            size = int(match.group(3))
+    except Exception as e:
+        logger.warning(f"Не удалось проверить поддержку Range: {e}")
+        return None
+    return size if size >= PARALLEL_MIN_BYTES else None
+
+
+def download_file(url: str, output_path: str, on_progress=None) -> int:
+    """Скачивает url в output_path; возвращает размер в байтах.
+
+    on_progress(скачано, всего) вызывается по мере скачивания, в том числе
+    из нескольких потоков.
+    """
+    # Запрос первого байта показывает, поддерживает ли сервер Range, и
+    # сообщает размер файла. Если не поддерживает, тело ответа - весь файл.
+    with get_http().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=300) as probe:
+        probe.raise_for_status()
+        _check_content_type(probe)
+
+        match = _CONTENT_RANGE.match(probe.headers.get("Content-Range", ""))
+        if probe.status_code != 206 or not match:
+            logger.info("Сервер не поддерживает Range, скачиваем одним потоком")
+            return _write_stream(probe, output_path, on_progress)
+
+        size = int(match.group(3))
+        # Ссылка Диска редиректит на сервер загрузки: сегменты качаем оттуда
+        final_url = probe.url
+
+    if size < PARALLEL_MIN_BYTES or DOWNLOAD_CONNECTIONS <= 1:
+        with get_http().get(final_url, stream=True, timeout=300) as response:
+            response.raise_for_status()
+            return _write_stream(response, output_path, on_progress)
+
+    _download_parallel(final_url, output_path, size, on_progress)
+    return size
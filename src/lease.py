@@ -0,0 +1,58 @@
+import os
+import threading
+
+from db import logger, extend_lease
+
+# Пока задание обрабатывается, сообщение остаётся невидимым в очереди,
+# а аренда строки задания в YDB продлевается. Без этого длинная лекция
+# переживала visibility timeout очереди и параллельно обрабатывалась
+# вторым контейнером.
+
+VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get("VISIBILITY_TIMEOUT_SECONDS", "300"))
+LEASE_SECONDS = int(os.environ.get("LEASE_SECONDS", str(VISIBILITY_TIMEOUT_SECONDS)))
+HEARTBEAT_INTERVAL_SECONDS = max(1, min(VISIBILITY_TIMEOUT_SECONDS, LEASE_SECONDS) // 3)
+
+
+class Heartbeat:
+    """Фоновый поток: ChangeMessageVisibility + продление аренды в YDB."""
+
+    def __init__(self, sqs, queue_url: str, receipt_handle: str, task_id: str, owner: str):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.receipt_handle = receipt_handle
+        self.task_id = task_id
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{task_id}", daemon=True)
+
+    def _beat(self):
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=self.receipt_handle,
+                VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось продлить видимость сообщения {self.task_id}: {e}")
+        try:
+            extend_lease(self.task_id, self.owner, LEASE_SECONDS)
+        except Exception as e:
+            logger.warning(f"Не удалось продлить аренду задания {self.task_id}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL_SECONDS):
+            self._beat()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
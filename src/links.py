@@ -0,0 +1,91 @@
+import os
+import re
+
+import requests
+
+from clients import get_http
+from db import logger
+from ttl_cache import TTLCache
+
+# Разрешение публичной ссылки Диска / 360 в ссылку на скачивание - это
+# несколько сетевых запросов. Результат кэшируется в памяти процесса, а
+# веб-приложение разрешает ссылку ещё при создании задания и сохраняет её
+# в YDB вместе со сроком годности.
+
+# Ссылки на скачивание подписаны и живут несколько часов; берём с запасом
+DOWNLOAD_URL_TTL_SECONDS = int(os.environ.get("DOWNLOAD_URL_TTL_SECONDS", "1800"))
+
+_download_urls = TTLCache(DOWNLOAD_URL_TTL_SECONDS)
+
+
+class LinkError(Exception):
+    """Ссылка точно не ведёт на файл: ресурс не найден или закрыт.
+
+    Сбои сети и 5xx остаются обычными Exception - это не повод
+    отклонять ссылку.
+    """
+
+
+def _client_error(e: Exception) -> bool:
+    """Ответ 4xx, кроме таймаута и лимита запросов, - повтор не поможет."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return False
+    return 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+def get_yandex_disk_download_url(public_url: str) -> str:
+    if 'downloader.disk' in public_url or 'download' in public_url.lower():
+        logger.info(f"Using direct download URL: {public_url}")
+        return public_url
+    
+    # Если это 360.yandex.ru - нужно получить download ссылку
+    if '360.yandex' in public_url or 'disk.360.yandex' in public_url:
+        logger.info(f"360.yandex URL detected, extracting download link from page")
+        try:
+            page_response = get_http().get(public_url, timeout=10)
+            page_response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            error = LinkError if _client_error(e) else Exception
+            raise error(f"Ошибка парсинга 360.yandex ссылки: {e}. Используйте прямую ссылку на скачивание.")
+        page_html = page_response.text
+
+        download_match = re.search(r'(https://downloader\.disk\.360\.yandex\.[^"\']+)', page_html)
+        if download_match:
+            download_url = download_match.group(1)
+            logger.info(f"Found download URL: {download_url}")
+            return download_url
+
+        # Альтернативный поиск через data атрибуты
+        data_match = re.search(r'"download":\s*"([^"]+)"', page_html)
+        if data_match:
+            download_url = data_match.group(1).replace('\\/', '/')
+            logger.info(f"Found download URL in data: {download_url}")
+            return download_url
+
+        raise LinkError(
+            "Ошибка парсинга 360.yandex ссылки: не удалось найти ссылку на скачивание на странице. "
+            "Используйте прямую ссылку на скачивание."
+        )
+    
+    api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
+    try:
+        response = get_http().get(api_url, params={"public_key": public_url}, timeout=10)
+        response.raise_for_status()
+        return response.json()["href"]
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"API failed: {e}")
+        error = LinkError if _client_error(e) else Exception
+        raise error(f"Не удалось получить ссылку на скачивание. Используйте прямую ссылку или обычный disk.yandex.ru")
+
+
+def resolve_download_url(public_url: str) -> str:
+    """get_yandex_disk_download_url с кэшем на DOWNLOAD_URL_TTL_SECONDS."""
+    download_url = _download_urls.get(public_url)
+    if download_url:
+        logger.info(f"Ссылка на скачивание из кэша: {public_url}")
+        return download_url
+
+    download_url = get_yandex_disk_download_url(public_url)
+    _download_urls.set(public_url, download_url)
+    return download_url
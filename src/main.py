@@ -1,17 +1,34 @@
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Request, Form, File, UploadFile
+from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 import uuid
 import os
-import boto3
-from botocore.client import Config
+import csv
+import io
+import asyncio
+from urllib.parse import urlparse
 
-from db import save_task, list_tasks
-from tasks_queue import enqueue
+from clients import get_s3
+from db import save_task_async, save_tasks_async, list_tasks_async, get_task_by_id_async, TaskRow, logger
+from links import resolve_download_url, LinkError, DOWNLOAD_URL_TTL_SECONDS
+from probe import probe_media, estimate_seconds, ProbeError, PROBE_ENABLED
+from tasks_queue import enqueue_async, enqueue_many_async, lane_for
+from ttl_cache import TTLCache
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
+# Максимум лекций в одной массовой загрузке
+BULK_MAX_TASKS = 500
+
+PRESIGNED_URL_EXPIRES_SECONDS = 3600  # 1 час
+# Подписанная ссылка переиспользуется, пока до её истечения остаётся
+# больше 5 минут: скачивание успевает начаться
+_presigned_urls = TTLCache(PRESIGNED_URL_EXPIRES_SECONDS - 300)
+# Сколько ждать разрешения ссылки при создании задания; дольше - воркер
+# разрешит её сам
+PRERESOLVE_TIMEOUT_SECONDS = float(os.environ.get("PRERESOLVE_TIMEOUT_SECONDS", "3"))
+
 
 @app.get("/")
 def index(request: Request):
@@ -19,43 +36,185 @@ def index(request: Request):
 
 
 @app.post("/tasks")
-def create_task(title: str = Form(...), video_url: str = Form(...)):
+async def create_task(request: Request, title: str = Form(...), video_url: str = Form(...)):
     task_id = str(uuid.uuid4())
     print("task_id=" + task_id)
-    save_task(task_id, title, video_url)
-    enqueue(task_id)
+
+    try:
+        download_url, media = await _inspect_link(video_url)
+    except ProbeError as e:
+        # Битая ссылка не доходит до очереди и не занимает воркер
+        return templates.TemplateResponse(
+            "index.html",
+            {"request": request, "error": str(e), "title": title, "video_url": video_url},
+            status_code=400,
+        )
+
+    if download_url == video_url:
+        download_url = None
+    lane = lane_for(duration_seconds=media.duration_seconds if media else None)
+
+    # Запись в YDB и постановка в очередь идут параллельно; воркер дожидается
+    # появления строки задания, если сообщение пришло раньше неё
+    await asyncio.gather(
+        save_task_async(
+            task_id, title, video_url,
+            download_url, DOWNLOAD_URL_TTL_SECONDS if download_url else None,
+            media, estimate_seconds(media),
+        ),
+        enqueue_async(task_id, lane),
+    )
+    return RedirectResponse("/tasks", status_code=303)
+
+
+async def _inspect_link(video_url):
+    """Разрешает ссылку на скачивание и проверяет файл через ffprobe.
+
+    Возвращает (ссылка на скачивание или None, MediaInfo или None).
+    ProbeError - ссылку нужно отклонить; если проверка просто не успела
+    или недоступна, задание создаётся как обычно.
+    """
+    try:
+        download_url = await asyncio.wait_for(
+            asyncio.to_thread(resolve_download_url, video_url),
+            PRERESOLVE_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Ссылка {video_url} не разрешена за {PRERESOLVE_TIMEOUT_SECONDS} с")
+        return None, None
+    except LinkError as e:
+        raise ProbeError(str(e))
+    except Exception as e:
+        # Временный сбой cloud-api или сети: воркер разрешит ссылку сам
+        logger.warning(f"Не удалось разрешить ссылку {video_url}: {e}")
+        return None, None
+
+    if not PROBE_ENABLED:
+        return download_url, None
+
+    try:
+        media = await asyncio.to_thread(probe_media, download_url)
+    except ProbeError:
+        raise
+    except Exception as e:
+        logger.warning(f"Не удалось проверить {video_url} через ffprobe: {e!r}")
+        media = None
+    return download_url, media
+
+
+# Заголовок CSV: по-английски, как в JSON, или по-русски, как в README и форме
+_CSV_TITLE_HEADERS = {"title", "название"}
+_CSV_URL_HEADERS = {"video_url", "url", "ссылка"}
+
+
+def _check_bulk_item(title: str, video_url: str):
+    """Отклоняет строку без http(s)-ссылки, чтобы она не попала в YDB и очередь."""
+    parsed = urlparse(video_url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        raise ValueError(f"Нет ссылки http(s) в строке \"{title},{video_url}\"")
+    return title, video_url
+
+
+def _parse_bulk_csv(text: str):
+    """Строки CSV вида "название,ссылка"; строка заголовка необязательна."""
+    items = []
+    first = True
+    for row in csv.reader(io.StringIO(text)):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            raise ValueError(f"Ожидается строка вида \"название,ссылка\": {','.join(row)}")
+        title, video_url = row[0].strip(), row[1].strip()
+        if first and title.lower() in _CSV_TITLE_HEADERS and video_url.lower() in _CSV_URL_HEADERS:
+            first = False
+            continue
+        first = False
+        items.append(_check_bulk_item(title, video_url))
+    return items
+
+
+@app.post("/tasks/bulk")
+async def create_tasks_bulk(
+    request: Request,
+    items: str = Form(None),
+    csv_file: UploadFile = File(None),
+):
+    """Массовое создание заданий: JSON-список {title, video_url}, CSV-файл
+    или CSV-текст из формы. Все строки пишутся в YDB одной транзакцией,
+    сообщения уходят в очередь пачками по 10."""
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    try:
+        if is_json:
+            payload = await request.json()
+            pairs = [_check_bulk_item(item["title"], item["video_url"]) for item in payload]
+        else:
+            pairs = []
+            if csv_file is not None and csv_file.filename:
+                pairs += _parse_bulk_csv((await csv_file.read()).decode("utf-8-sig"))
+            if items:
+                pairs += _parse_bulk_csv(items)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JSONResponse({"error": f"Некорректные данные: {e}"}, status_code=400)
+
+    if not pairs:
+        return JSONResponse({"error": "Список лекций пуст"}, status_code=400)
+    if len(pairs) > BULK_MAX_TASKS:
+        return JSONResponse({"error": f"Не больше {BULK_MAX_TASKS} лекций за раз"}, status_code=400)
+
+    rows = [TaskRow(str(uuid.uuid4()), title, video_url) for title, video_url in pairs]
+    # Сначала строки, потом сообщения: воркер не получит задание раньше записи
+    await save_tasks_async(rows)
+    await enqueue_many_async([row.id for row in rows])
+    logger.info(f"Массовая загрузка: создано заданий: {len(rows)}")
+
+    if is_json:
+        return {"task_ids": [row.id for row in rows]}
     return RedirectResponse("/tasks", status_code=303)
 
 
 @app.get("/tasks")
-def tasks(request: Request):
-    result = list_tasks()
+async def tasks(request: Request, cursor: str = None):
+    try:
+        result, next_cursor = await list_tasks_async(cursor=cursor)
+    except ValueError:
+        return RedirectResponse("/tasks", status_code=303)
     return templates.TemplateResponse(
         "tasks.html",
-        {"request": request, "tasks": result},
+        {"request": request, "tasks": result, "next_cursor": next_cursor},
     )
 
 
+@app.get("/tasks/{task_id}/status")
+async def task_status(task_id: str):
+    """Статус и прогресс одного задания для опроса со страницы."""
+    task = await get_task_by_id_async(task_id)
+    if not task:
+        return JSONResponse({"error": "Задание не найдено"}, status_code=404)
+    return {
+        "id": task["id"],
+        "status": task["status"],
+        "progress": task["progress"],
+        "error": task["error"],
+        "duration_seconds": task["duration_seconds"],
+        "eta_seconds": task["eta_seconds"],
+        "pdf_url": f"/download/{task['pdf_object_key']}" if task["pdf_object_key"] else None,
+    }
+
+
 @app.get("/download/{object_key}")
 def download_pdf(object_key: str):
     try:
-        s3 = boto3.client(
-            's3',
-            endpoint_url='https://storage.yandexcloud.net',
-            region_name='ru-central1',
-            aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-            config=Config(signature_version='s3v4')
-        )
-        
-        presigned_url = s3.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': os.environ.get("BUCKET_NAME"),
-                'Key': object_key
-            },
-            ExpiresIn=3600  # 1 час
-        )
+        presigned_url = _presigned_urls.get(object_key)
+        if not presigned_url:
+            presigned_url = get_s3().generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': os.environ.get("BUCKET_NAME"),
+                    'Key': object_key
+                },
+                ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS
+            )
+            _presigned_urls.set(object_key, presigned_url)
         
         return RedirectResponse(presigned_url)
     except Exception as e:
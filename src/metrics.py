@@ -0,0 +1,84 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+from db import logger, save_task_spans, SpanRow
+
+# Длительности этапов обработки: от секунд (ссылка, PDF) до десятков минут (STT)
+_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+
+STAGE_DURATION = Histogram(
+    "worker_stage_duration_seconds",
+    "Длительность этапа обработки задания",
+    ["stage", "outcome"],
+    buckets=_BUCKETS,
+)
+STAGE_BYTES = Counter(
+    "worker_stage_bytes_total",
+    "Объём данных, обработанных этапом",
+    ["stage"],
+)
+VAD_REMOVED_SECONDS = Counter(
+    "worker_vad_removed_seconds_total",
+    "Секунды пауз, вырезанные из аудио перед распознаванием",
+)
+TASK_DURATION = Histogram(
+    "worker_task_duration_seconds",
+    "Полное время обработки задания",
+    ["outcome"],
+    buckets=_BUCKETS,
+)
+
+
+class Span:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.bytes = 0
+        self.outcome = "ok"
+        self.duration = 0.0
+
+
+class TaskTrace:
+    """Собирает этапы обработки одного задания.
+
+    Каждый этап пишется в гистограммы Prometheus сразу, а по завершении
+    задания весь список этапов сохраняется в YDB (таблица task_spans).
+    """
+
+    def __init__(self, task_id: str, attempt: int = 1):
+        self.task_id = task_id
+        # Номер доставки сообщения: этапы повторных попыток не затирают друг друга
+        self.attempt = attempt
+        self.spans = []
+        self._started = time.monotonic()
+
+    @contextmanager
+    def span(self, stage: str):
+        span = Span(stage)
+        start = time.monotonic()
+        try:
+            yield span
+        except BaseException:
+            span.outcome = "error"
+            raise
+        finally:
+            span.duration = time.monotonic() - start
+            STAGE_DURATION.labels(stage, span.outcome).observe(span.duration)
+            if span.bytes:
+                STAGE_BYTES.labels(stage).inc(span.bytes)
+            self.spans.append(span)
+            logger.info(
+                f"task={self.task_id} stage={stage} duration={span.duration:.3f}s "
+                f"bytes={span.bytes} outcome={span.outcome}"
+            )
+
+    def finish(self, outcome: str):
+        TASK_DURATION.labels(outcome).observe(time.monotonic() - self._started)
+        try:
+            save_task_spans([
+                SpanRow(self.task_id, self.attempt, seq, s.stage, int(s.duration * 1000), int(s.bytes), s.outcome)
+                for seq, s in enumerate(self.spans)
+            ])
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить этапы задания {self.task_id}: {e}")
@@ -0,0 +1,248 @@
+import re
+import threading
+from xml.sax.saxutils import escape
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, ListFlowable, ListItem
+
+from db import logger
+
+# Конспект от YandexGPT - Markdown: заголовки, нумерованные и маркированные
+# списки, **жирный**. Шрифты и стили регистрируются один раз на процесс,
+# разметка превращается в заголовки и ListFlowable ReportLab.
+
+FONT_DIR = "/usr/share/fonts/truetype/dejavu"
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+_NUMBERED = re.compile(r"^(\s*)(\d+)[.)]\s+(.*)$")
+_BULLET = re.compile(r"^(\s*)[-*+•]\s+(.*)$")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_BOLD = re.compile(r"\*\*(.+?)\*\*|__(.+?)__")
+_ITALIC = re.compile(r"(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])")
+
+_lock = threading.Lock()
+_styles = None
+
+
+def _register_fonts():
+    try:
+        pdfmetrics.registerFont(TTFont("DejaVuSans", f"{FONT_DIR}/DejaVuSans.ttf"))
+        pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", f"{FONT_DIR}/DejaVuSans-Bold.ttf"))
+        # Курсива в fonts-dejavu-core нет - <i> рисуется обычным начертанием
+        pdfmetrics.registerFontFamily(
+            "DejaVuSans",
+            normal="DejaVuSans",
+            bold="DejaVuSans-Bold",
+            italic="DejaVuSans",
+            boldItalic="DejaVuSans-Bold",
+        )
+        return "DejaVuSans", "DejaVuSans-Bold"
+    except Exception as e:
+        logger.warning(f"Не удалось зарегистрировать DejaVuSans шрифты для PDF: {e}")
+        return "Helvetica", "Helvetica-Bold"
+
+
+def get_styles() -> dict:
+    """Стили PDF; при первом вызове регистрирует шрифты."""
+    global _styles
+    if _styles is None:
+        with _lock:
+            if _styles is None:
+                base_font, bold_font = _register_fonts()
+                sample = getSampleStyleSheet()
+                _styles = {
+                    "font": base_font,
+                    "title": ParagraphStyle(
+                        "NotesTitle",
+                        parent=sample["Heading1"],
+                        fontName=bold_font,
+                        fontSize=18,
+                        spaceAfter=30,
+                        alignment=1,  # центрирование
+                    ),
+                    "h1": ParagraphStyle("NotesH1", parent=sample["Heading1"], fontName=bold_font, fontSize=16, leading=20),
+                    "h2": ParagraphStyle("NotesH2", parent=sample["Heading2"], fontName=bold_font, fontSize=14, leading=18),
+                    "h3": ParagraphStyle("NotesH3", parent=sample["Heading3"], fontName=bold_font, fontSize=12, leading=16),
+                    "body": ParagraphStyle(
+                        "NotesBody",
+                        parent=sample["Normal"],
+                        fontName=base_font,
+                        fontSize=12,
+                        leading=16,
+                        spaceAfter=12,
+                    ),
+                    "item": ParagraphStyle(
+                        "NotesItem",
+                        parent=sample["Normal"],
+                        fontName=base_font,
+                        fontSize=12,
+                        leading=16,
+                        spaceAfter=4,
+                    ),
+                }
+    return _styles
+
+
+def inline(text: str) -> str:
+    """Экранирует XML-спецсимволы и переводит **жирный**/*курсив* в теги Paragraph."""
+    text = escape(text.strip())
+    text = _BOLD.sub(lambda m: f"<b>{m.group(1) or m.group(2)}</b>", text)
+    return _ITALIC.sub(r"<i>\1</i>", text)
+
+
+def _make_list(kind, start, flowables, styles):
+    if kind == "number":
+        return ListFlowable(flowables, bulletType="1", start=start, bulletFontName=styles["font"], leftIndent=18)
+    return ListFlowable(flowables, bulletType="bullet", start="•", bulletFontName=styles["font"], leftIndent=18)
+
+
+def _list_flowables(items, styles):
+    """items - [(отступ, "number"|"bullet", номер, текст)]; вложенность по отступу.
+
+    Смена вида пунктов на одном уровне начинает новый список, иначе
+    маркированные пункты после нумерованных получили бы номера.
+    """
+    base = items[0][0]
+    lists = []
+    kind = start = None
+    flowables = []
+    i = 0
+    while i < len(items):
+        _, item_kind, number, text = items[i]
+        if item_kind != kind:
+            if flowables:
+                lists.append(_make_list(kind, start, flowables, styles))
+            kind, start, flowables = item_kind, number, []
+        j = i + 1
+        while j < len(items) and items[j][0] > base:
+            j += 1
+        content = [Paragraph(inline(text), styles["item"])]
+        if j > i + 1:
+            content.extend(_list_flowables(items[i + 1:j], styles))
+        flowables.append(ListItem(content, value=number if kind == "number" else None))
+        i = j
+
+    lists.append(_make_list(kind, start, flowables, styles))
+    return lists
+
+
+def markdown_flowables(notes: str, styles: dict):
+    """Разбирает конспект построчно и по одному отдаёт flowable-блоки."""
+    paragraph = []
+    items = []
+
+    def flush_paragraph():
+        if paragraph:
+            yield Paragraph("<br/>".join(inline(line) for line in paragraph), styles["body"])
+            paragraph.clear()
+
+    def flush_list():
+        if items:
+            yield from _list_flowables(items, styles)
+            yield Spacer(1, 8)
+            items.clear()
+
+    for line in notes.splitlines():
+        heading = _HEADING.match(line)
+        numbered = _NUMBERED.match(line)
+        bullet = None if numbered else _BULLET.match(line)
+
+        if not line.strip():
+            yield from flush_paragraph()
+            continue
+        if _RULE.match(line):
+            yield from flush_paragraph()
+            yield from flush_list()
+            yield Spacer(1, 12)
+            continue
+        if heading:
+            yield from flush_paragraph()
+            yield from flush_list()
+            level = min(len(heading.group(1)), 3)
+            yield Paragraph(inline(heading.group(2)), styles[f"h{level}"])
+            continue
+        if numbered or bullet:
+            yield from flush_paragraph()
+            if numbered:
+                items.append((len(numbered.group(1)), "number", int(numbered.group(2)), numbered.group(3)))
+            else:
+                items.append((len(bullet.group(1)), "bullet", None, bullet.group(2)))
+            continue
+        if items and line[:1].isspace():
+            # Продолжение пункта списка на следующей строке
+            indent, kind, number, text = items[-1]
+            items[-1] = (indent, kind, number, f"{text} {line.strip()}")
+            continue
+
+        yield from flush_list()
+        paragraph.append(line)
+
+    yield from flush_paragraph()
+    yield from flush_list()
+
+
+class _LazyStory(list):
+    """Story для doc.build(), дочитывающая flowables из генератора.
+
+    build() берёт блоки с начала списка и удаляет размещённые, поэтому в
+    памяти держится лишь небольшой запас впереди - он нужен заголовкам с
+    keepWithNext, которые заглядывают на следующие блоки.
+    """
+
+    LOOKAHEAD = 16
+
+    def __init__(self, head, source):
+        super().__init__(head)
+        self._source = source
+        self.produced = len(head)
+
+    def _fill(self):
+        while self._source is not None and super().__len__() < self.LOOKAHEAD:
+            try:
+                self.append(next(self._source))
+                self.produced += 1
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return super().__len__()
+
+    def __getitem__(self, index):
+        self._fill()
+        return super().__getitem__(index)
+
+
+def generate_pdf(title: str, notes: str, output):
+    """Рисует PDF в output - путь к файлу или открытый двоичный буфер.
+
+    Документ детерминирован (invariant): одинаковые название и конспект
+    дают побайтно одинаковый PDF, что позволяет хранить его по хэшу.
+    """
+    styles = get_styles()
+
+    doc = SimpleDocTemplate(
+        output,
+        pagesize=A4,
+        rightMargin=2*cm,
+        leftMargin=2*cm,
+        topMargin=2*cm,
+        bottomMargin=2*cm,
+        title=title,
+        invariant=1,
+    )
+
+    # Блоки разбираются из конспекта по мере выкладки страниц, а не все
+    # заранее. Готовые страницы canvas ReportLab всё равно держит до
+    # сохранения, поэтому сам PDF пишется в буфер, который при большом
+    # размере уходит на диск (см. worker).
+    story = _LazyStory(
+        [Paragraph(escape(title), styles["title"]), Spacer(1, 20)],
+        markdown_flowables(notes, styles),
+    )
+    doc.build(story)
+    logger.info(f"PDF создан, блоков: {story.produced}")
@@ -0,0 +1,79 @@
+import os
+import re
+import json
+import subprocess
+from collections import namedtuple
+
+from db import logger
+
+# Проверка ссылки при создании задания: ffprobe читает по HTTP только
+# заголовок контейнера (при moov в конце файла - ещё и его хвост
+# Range-запросом), а не всё видео. Битые и не медийные ссылки отклоняются
+# сразу и не занимают воркер.
+
+PROBE_ENABLED = os.environ.get("PROBE_ENABLED", "1") == "1"
+PROBE_TIMEOUT_SECONDS = float(os.environ.get("PROBE_TIMEOUT_SECONDS", "15"))
+
+# Оценка времени обработки: постоянная часть плюс доля длительности лекции
+ETA_BASE_SECONDS = int(os.environ.get("ETA_BASE_SECONDS", "60"))
+ETA_REALTIME_FACTOR = float(os.environ.get("ETA_REALTIME_FACTOR", "0.2"))
+
+# Ошибки ffprobe, после которых ссылка может заработать: сбой сервера или сети
+_TRANSIENT = re.compile(
+    r"5XX|Server Error|timed out|Connection refused|Connection reset|Network is unreachable|"
+    r"Failed to resolve|Temporary failure|Input/output error",
+    re.IGNORECASE,
+)
+
+MediaInfo = namedtuple("MediaInfo", ["duration_seconds", "audio_codec", "size_bytes", "format_name"])
+
+
+class ProbeError(Exception):
+    """Ссылка недоступна или ведёт не на медиафайл."""
+
+
+def probe_media(url: str) -> MediaInfo:
+    """Длительность, кодек звука и размер файла по ссылке.
+
+    ProbeError - файл точно не подходит; таймаут, сбой сервера или сети и
+    отсутствие ffprobe пробрасываются как обычные исключения, это не повод
+    отклонять ссылку.
+    """
+    result = subprocess.run([
+        "ffprobe",
+        "-v", "error",
+        "-rw_timeout", str(int(PROBE_TIMEOUT_SECONDS * 1_000_000)),
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        url,
+    ], capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS)
+
+    if result.returncode != 0:
+        reason = result.stderr.strip().splitlines()[-1:] or [f"код {result.returncode}"]
+        if _TRANSIENT.search(result.stderr):
+            raise Exception(f"ffprobe не смог прочитать ссылку: {reason[0]}")
+        raise ProbeError(f"Ссылка не открывается как видео: {reason[0]}")
+
+    data = json.loads(result.stdout or "{}")
+    fmt = data.get("format", {})
+    audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), None)
+    if not audio:
+        raise ProbeError("В файле по ссылке нет звуковой дорожки")
+
+    duration = float(fmt.get("duration") or audio.get("duration") or 0)
+    info = MediaInfo(
+        duration_seconds=duration or None,
+        audio_codec=audio.get("codec_name"),
+        size_bytes=int(fmt["size"]) if fmt.get("size") else None,
+        format_name=fmt.get("format_name"),
+    )
+    logger.info(f"ffprobe: {info}")
+    return info
+
+
+def estimate_seconds(info) -> int:
+    """Ожидаемое время обработки лекции или None, если длительность неизвестна."""
+    if not info or not info.duration_seconds:
+        return None
+    return int(ETA_BASE_SECONDS + info.duration_seconds * ETA_REALTIME_FACTOR)
@@ -0,0 +1,69 @@
+import os
+import threading
+
+from db import logger, update_task
+
+# Ход обработки (процент скачивания, распознанные фрагменты, готовые секции
+# конспекта) сообщается часто и из разных потоков. В YDB попадает только
+# последнее значение и не чаще раза в PROGRESS_INTERVAL_SECONDS на задание.
+
+PROGRESS_INTERVAL_SECONDS = float(os.environ.get("PROGRESS_INTERVAL_SECONDS", "5"))
+
+
+def percent(done, total) -> str:
+    return f"{min(100, int(done * 100 / total))}%" if total else ""
+
+
+class ProgressReporter:
+    """Фоновый поток, сбрасывающий последний прогресс задания в tasks.progress."""
+
+    def __init__(self, task_id: str, interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.task_id = task_id
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"progress-{task_id}", daemon=True)
+
+    def report(self, text: str):
+        """Запоминает прогресс; запись в YDB произойдёт на ближайшем тике."""
+        if self._stop.is_set():
+            return
+        with self._lock:
+            self._pending = text
+
+    def callback(self, label: str, unit: str = None):
+        """Функция (done, total) для этапов: пишет «label: 40%» или «label: 4/10 unit»."""
+        def on_progress(done, total):
+            if unit:
+                self.report(f"{label}: {done}/{total} {unit}")
+            else:
+                self.report(f"{label}: {percent(done, total)}")
+        return on_progress
+
+    def _flush(self):
+        with self._lock:
+            text, self._pending = self._pending, None
+        if text is None:
+            return
+        try:
+            update_task(self.task_id, progress=text)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить прогресс задания {self.task_id}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._flush()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True):
+        """Останавливает поток; повторный вызов ничего не делает."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        if flush:
+            self._flush()
@@ -0,0 +1,175 @@
+import os
+import subprocess
+import wave
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from clients import get_http, get_iam_token
+from db import logger
+
+STT_URL = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # pcm_s16le
+
+# Синхронное API принимает не более 30 секунд и 1 МБ аудио
+MAX_CHUNK_SECONDS = 29
+# В последних секундах куска ищем самую тихую точку для разреза
+SILENCE_SEARCH_SECONDS = 5
+FRAME_MS = 50
+
+# Формат отправки в SpeechKit: lpcm - сырой PCM как есть, oggopus - кусок
+# сжимается ffmpeg примерно в 10 раз, но на каждый кусок уходит около
+# секунды процессора. Сжатие имеет смысл только при узком исходящем канале.
+STT_AUDIO_FORMAT = os.environ.get("STT_AUDIO_FORMAT", "lpcm")
+OPUS_BITRATE = os.environ.get("STT_OPUS_BITRATE", "32k")
+
+STT_CONCURRENCY = int(os.environ.get("STT_CONCURRENCY", "8"))
+# Сколько кусков (до ~1 МБ каждый) может ждать распознавания одновременно
+STT_IN_FLIGHT = STT_CONCURRENCY * 2
+STT_RETRIES = 2
+
+
+def _quietest_cut(samples: array, search_from: int, search_to: int) -> int:
+    """Индекс начала самого тихого фрейма в диапазоне [search_from, search_to)."""
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    best_pos = search_to
+    best_energy = None
+    for pos in range(search_from, search_to - frame + 1, frame):
+        energy = sum(map(abs, samples[pos:pos + frame]))
+        if best_energy is None or energy < best_energy:
+            best_energy = energy
+            best_pos = pos
+    return best_pos
+
+
+def split_on_silence(audio_path: str):
+    """Режет WAV (16 кГц, моно, s16le) на куски для синхронного API.
+
+    Каждый кусок не длиннее MAX_CHUNK_SECONDS, разрез делается по самому
+    тихому месту в конце куска, чтобы не рвать слова. Генератор: файл
+    читается по мере потребления кусков, в памяти держится не больше
+    одного куска, сколько бы ни длилась лекция.
+    """
+    max_samples = MAX_CHUNK_SECONDS * SAMPLE_RATE
+    search_samples = SILENCE_SEARCH_SECONDS * SAMPLE_RATE
+
+    count = 0
+    buf = array("h")
+    with wave.open(audio_path, "rb") as wav:
+        if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+            raise Exception(
+                f"Неожиданный формат аудио: {wav.getframerate()} Гц, "
+                f"{wav.getnchannels()} канал(ов), {wav.getsampwidth() * 8} бит"
+            )
+
+        while True:
+            data = wav.readframes(max_samples - len(buf))
+            if data:
+                buf.frombytes(data)
+
+            if len(buf) < max_samples:
+                # Конец файла: остаток уходит последним куском
+                if len(buf):
+                    count += 1
+                    yield buf.tobytes()
+                break
+
+            cut = _quietest_cut(buf, max_samples - search_samples, max_samples)
+            count += 1
+            yield buf[:cut].tobytes()
+            buf = buf[cut:]
+
+    logger.info(f"Аудио разбито на {count} кусков по <= {MAX_CHUNK_SECONDS} с")
+
+
+def encode_oggopus(pcm: bytes) -> bytes:
+    """Сжимает кусок PCM в OggOpus через ffmpeg (stdin -> stdout)."""
+    result = subprocess.run([
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip",
+        "-f", "ogg", "pipe:1",
+    ], input=pcm, capture_output=True)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg failed with code {result.returncode}: {result.stderr[-500:]}")
+    return result.stdout
+
+
+def _stt_payload(pcm: bytes):
+    """Тело запроса и параметры формата для куска."""
+    if STT_AUDIO_FORMAT == "oggopus":
+        try:
+            return encode_oggopus(pcm), {"format": "oggopus"}
+        except Exception as e:
+            logger.warning(f"Не удалось сжать кусок в OggOpus, отправляем PCM: {e}")
+    return pcm, {"format": "lpcm", "sampleRateHertz": str(SAMPLE_RATE)}
+
+
+def recognize_chunk(pcm: bytes, folder_id: str) -> str:
+    """Распознаёт один кусок через синхронное API SpeechKit.
+
+    IAM-токен берётся на каждый запрос: из кэша это дёшево, а длинное
+    распознавание не упирается в истечение токена.
+    """
+    data, audio_params = _stt_payload(pcm)
+    last_error = None
+    for attempt in range(STT_RETRIES + 1):
+        try:
+            response = get_http().post(
+                STT_URL,
+                headers={"Authorization": f"Bearer {get_iam_token()}"},
+                params={
+                    "folderId": folder_id,
+                    "lang": "ru-RU",
+                    **audio_params,
+                },
+                data=data,
+                timeout=60,
+            )
+            response.raise_for_status()
+            return response.json().get("result", "")
+        except requests.exceptions.RequestException as e:
+            last_error = e
+            logger.warning(f"Ошибка распознавания куска (попытка {attempt + 1}): {e}")
+    raise Exception(f"Не удалось распознать фрагмент аудио: {last_error}")
+
+
+def recognize_long_audio(audio_path: str, folder_id: str, on_progress=None) -> str:
+    """Распознаёт аудио любой длины: режет по паузам и распознаёт куски параллельно.
+
+    Время распознавания определяется самым медленным куском, а не общей
+    длиной лекции. Одновременно в работе не больше STT_IN_FLIGHT кусков,
+    поэтому пиковая память не зависит от длины лекции. Текст склеивается
+    в исходном порядке. on_progress(секунд распознано, секунд всего)
+    вызывается по мере готовности кусков.
+    """
+    with wave.open(audio_path, "rb") as wav:
+        total_seconds = int(wav.getnframes() / wav.getframerate())
+    done_seconds = 0
+    results = []
+
+    def collect(future):
+        nonlocal done_seconds
+        text, seconds = future.result()
+        results.append(text)
+        done_seconds += seconds
+        if on_progress:
+            on_progress(min(int(done_seconds), total_seconds), total_seconds)
+
+    def recognize(pcm):
+        return recognize_chunk(pcm, folder_id), len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=STT_CONCURRENCY) as pool:
+        for pcm in split_on_silence(audio_path):
+            if len(pending) >= STT_IN_FLIGHT:
+                collect(pending.popleft())
+            pending.append(pool.submit(recognize, pcm))
+        while pending:
+            collect(pending.popleft())
+
+    return " ".join(text.strip() for text in results if text and text.strip())
@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import logger
+
+# Длинный транскрипт не помещается в контекст модели, поэтому конспект
+# строится в два этапа: куски транскрипта конспектируются параллельно (map),
+# затем конспекты кусков сводятся в итоговый конспект (reduce).
+
+# Грубая оценка: для русского текста ~3 символа на токен
+CHARS_PER_TOKEN = 3
+SECTION_MAX_TOKENS = int(os.environ.get("GPT_SECTION_MAX_TOKENS", "5000"))
+GPT_CONCURRENCY = int(os.environ.get("GPT_CONCURRENCY", "4"))
+GPT_MAX_RPS = float(os.environ.get("GPT_MAX_RPS", "5"))
+GPT_RETRIES = 2
+
+NOTES_PROMPT = """Создай структурированный конспект лекции на основе следующего текста.
+
+Требования к конспекту:
+- Выдели основные темы и подтемы
+- Используй нумерованные и маркированные списки
+- Выдели ключевые определения и термины
+- Добавь краткое резюме в конце
+
+Текст лекции:
+{text}"""
+
+SECTION_PROMPT = """Это фрагмент {index} из {total} расшифровки длинной лекции.
+Кратко законспектируй его: перечисли темы, ключевые определения, термины,
+формулы и примеры. Не добавляй вступление и общее резюме.
+
+Фрагмент лекции:
+{text}"""
+
+REDUCE_PROMPT = """Ниже конспекты последовательных фрагментов одной лекции.
+Объедини их в единый структурированный конспект лекции.
+
+Требования к конспекту:
+- Выдели основные темы и подтемы
+- Используй нумерованные и маркированные списки
+- Выдели ключевые определения и термины
+- Убери повторы между фрагментами
+- Добавь краткое резюме в конце
+
+Конспекты фрагментов:
+{text}"""
+
+MERGE_PROMPT = """Ниже конспекты последовательных фрагментов одной лекции.
+Объедини их в один более короткий конспект этой части лекции, сохранив
+темы, определения и термины. Не добавляй общее резюме.
+
+Конспекты фрагментов:
+{text}"""
+
+
+class _RateLimiter:
+    """Не больше rps запросов в секунду на процесс."""
+
+    def __init__(self, rps: float):
+        self._interval = 1.0 / rps if rps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+_limiter = _RateLimiter(GPT_MAX_RPS)
+
+
+def _max_chars() -> int:
+    return SECTION_MAX_TOKENS * CHARS_PER_TOKEN
+
+
+def split_sections(text: str, max_chars: int = None):
+    """Режет текст на куски не длиннее max_chars по границам предложений."""
+    max_chars = max_chars or _max_chars()
+    sentences = re.split(r"(?<=[.!?…])\s+|\n{2,}", text)
+
+    sections = []
+    current = ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # Очень длинное "предложение" (нет знаков препинания) режем как есть
+        while len(sentence) > max_chars:
+            if current:
+                sections.append(current)
+                current = ""
+            sections.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            sections.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        sections.append(current)
+    return sections
+
+
+def _run(sdk, prompt: str) -> str:
+    last_error = None
+    for attempt in range(GPT_RETRIES + 1):
+        _limiter.wait()
+        try:
+            gpt_model = sdk.models.completions("yandexgpt")
+            gpt_model = gpt_model.configure(temperature=0.3)
+            response = gpt_model.run(prompt)
+            return str(response.alternatives[0].text)
+        except Exception as e:
+            last_error = e
+            logger.warning(f"Ошибка YandexGPT (попытка {attempt + 1}): {e}")
+            if attempt < GPT_RETRIES:
+                time.sleep(2 ** attempt)
+    raise last_error
+
+
+def _map(sdk, template: str, sections, on_done=None):
+    total = len(sections)
+    workers = max(1, min(GPT_CONCURRENCY, total))
+
+    def run(item):
+        result = _run(sdk, template.format(index=item[0] + 1, total=total, text=item[1]))
+        if on_done:
+            on_done()
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, enumerate(sections)))
+
+
+def generate_notes(sdk, transcript: str, on_progress=None) -> str:
+    """Строит конспект лекции любой длины.
+
+    Короткий транскрипт конспектируется одним запросом. Длинный режется на
+    секции, которые конспектируются параллельно (не больше GPT_CONCURRENCY
+    одновременно и GPT_MAX_RPS запросов в секунду), после чего конспекты
+    секций сводятся в итоговый; если они сами не помещаются в контекст,
+    сведение повторяется по уровням. on_progress(готово, всего) считает
+    запросы к модели, включая сведение.
+    """
+    max_chars = _max_chars()
+    if len(transcript) <= max_chars:
+        return _run(sdk, NOTES_PROMPT.format(text=transcript))
+
+    sections = split_sections(transcript, max_chars)
+    logger.info(f"Транскрипт разбит на {len(sections)} секций для конспектирования")
+
+    lock = threading.Lock()
+    # Секции плюс итоговое сведение; промежуточные сведения добавляются по ходу
+    progress = {"done": 0, "total": len(sections) + 1}
+
+    def on_done():
+        with lock:
+            progress["done"] += 1
+            done, total = progress["done"], progress["total"]
+        if on_progress:
+            on_progress(done, total)
+
+    summaries = _map(sdk, SECTION_PROMPT, sections, on_done)
+
+    separator = "\n\n---\n\n"
+    while len(separator.join(summaries)) > max_chars and len(summaries) > 1:
+        groups = _group(summaries, max_chars, separator)
+        if len(groups) == len(summaries):
+            # Конспекты секций слишком длинные, чтобы сводить их попарно
+            break
+        logger.info(f"Промежуточное сведение: {len(summaries)} -> {len(groups)} конспектов")
+        with lock:
+            progress["total"] += len(groups)
+        summaries = _map(sdk, MERGE_PROMPT, groups, on_done)
+
+    if len(summaries) > 1 and len(separator.join(summaries)) > max_chars:
+        logger.warning("Конспекты секций не помещаются в контекст, итоговое сведение пропущено")
+        return "\n\n".join(summaries)
+
+    notes = _run(sdk, REDUCE_PROMPT.format(text=separator.join(summaries)))
+    on_done()
+    return notes
+
+
+def _group(summaries, max_chars: int, separator: str):
+    groups = []
+    current = []
+    size = 0
+    for summary in summaries:
+        if current and size + len(separator) + len(summary) > max_chars:
+            groups.append(separator.join(current))
+            current = []
+            size = 0
+        current.append(summary)
+        size += len(summary) + (len(separator) if size else 0)
+    if current:
+        groups.append(separator.join(current))
+    return groups
@@ -1,17 +1,105 @@
 import os
 import json
-import boto3
+import asyncio
+import threading
 
+from clients import get_sqs, get_sqs_async
 
-def enqueue(task_id: str):
-    sqs = boto3.session.Session().client(
-        service_name='sqs',
-        endpoint_url='https://message-queue.api.cloud.yandex.net',
-        region_name='ru-central1',
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
+# Задания раскладываются по двум очередям-полосам: interactive - одиночные
+# лекции, bulk - массовые загрузки и длинные лекции. Воркер забирает
+# сообщения из полос по весам, поэтому курс из 40 лекций не задерживает
+# чужую одиночную лекцию. Без QUEUE_URL_BULK обе полосы - одна очередь.
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+LANE_WEIGHTS = {
+    LANE_INTERACTIVE: int(os.environ.get("LANE_WEIGHT_INTERACTIVE", "3")),
+    LANE_BULK: int(os.environ.get("LANE_WEIGHT_BULK", "1")),
+}
+# Лекции длиннее этого уходят в полосу bulk, чтобы короткие шли первыми
+LONG_LECTURE_SECONDS = int(os.environ.get("LONG_LECTURE_SECONDS", "5400"))
+
+
+def queue_url(lane: str = LANE_INTERACTIVE) -> str:
+    if lane == LANE_BULK:
+        return os.environ.get("QUEUE_URL_BULK") or os.environ.get("QUEUE_URL")
+    return os.environ.get("QUEUE_URL")
+
+
+def lane_for(bulk: bool = False, duration_seconds=None) -> str:
+    if bulk or (duration_seconds and duration_seconds > LONG_LECTURE_SECONDS):
+        return LANE_BULK
+    return LANE_INTERACTIVE
+
+
+class LaneScheduler:
+    """Плавный взвешенный round-robin (как в nginx) по полосам очереди.
+
+    plan(n) распределяет n мест между полосами пропорционально весам;
+    состояние копится между вызовами, поэтому доли соблюдаются и при
+    выборке по одному сообщению.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = dict(weights or LANE_WEIGHTS)
+        self._credits = {lane: 0 for lane in self.weights}
+        self._lock = threading.Lock()
+
+    def plan(self, n: int):
+        """Список полос в порядке выборки, n элементов."""
+        total = sum(self.weights.values())
+        order = []
+        with self._lock:
+            for _ in range(n):
+                for lane, weight in self.weights.items():
+                    self._credits[lane] += weight
+                lane = max(self._credits, key=self._credits.get)
+                self._credits[lane] -= total
+                order.append(lane)
+        return order
+
+
+def enqueue(task_id: str, lane: str = LANE_INTERACTIVE):
+    get_sqs().send_message(
+        QueueUrl=queue_url(lane),
+        MessageBody=json.dumps({"task_id": task_id}),
     )
-    sqs.send_message(
-        QueueUrl=os.environ.get("QUEUE_URL"),
+
+
+async def enqueue_async(task_id: str, lane: str = LANE_INTERACTIVE):
+    sqs = await get_sqs_async()
+    await sqs.send_message(
+        QueueUrl=queue_url(lane),
         MessageBody=json.dumps({"task_id": task_id}),
     )
+
+
+# Ограничение SendMessageBatch
+SEND_BATCH_SIZE = 10
+
+
+async def _send_batch(sqs, task_ids, lane):
+    entries = [
+        {"Id": str(i), "MessageBody": json.dumps({"task_id": task_id})}
+        for i, task_id in enumerate(task_ids)
+    ]
+    response = await sqs.send_message_batch(
+        QueueUrl=queue_url(lane),
+        Entries=entries,
+    )
+    # Неудачные сообщения пакета повторяем по одному
+    for failed in response.get("Failed", []):
+        await sqs.send_message(
+            QueueUrl=queue_url(lane),
+            MessageBody=entries[int(failed["Id"])]["MessageBody"],
+        )
+
+
+async def enqueue_many_async(task_ids, lane: str = LANE_BULK):
+    """Ставит задания в очередь пачками по 10 через SendMessageBatch."""
+    sqs = await get_sqs_async()
+    await asyncio.gather(*(
+        _send_batch(sqs, task_ids[i:i + SEND_BATCH_SIZE], lane)
+        for i in range(0, len(task_ids), SEND_BATCH_SIZE)
+    ))
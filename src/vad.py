@@ -0,0 +1,133 @@
+import math
+import os
+import wave
+from array import array
+from collections import deque
+
+from db import logger
+
+# Вырезает из аудио длинные паузы до распознавания: перерывы, тишину до и
+# после пары. Детектор энергетический - фрейм считается речью, если его
+# громкость выше порога. Короткие паузы между фразами не трогаются, у
+# каждой вырезанной паузы остаются поля VAD_PADDING_MS с обеих сторон.
+
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "1") == "1"
+VAD_THRESHOLD_DBFS = float(os.environ.get("VAD_THRESHOLD_DBFS", "-45"))
+VAD_MIN_SILENCE_SECONDS = float(os.environ.get("VAD_MIN_SILENCE_SECONDS", "2"))
+VAD_PADDING_MS = int(os.environ.get("VAD_PADDING_MS", "300"))
+VAD_FRAME_MS = 30
+
+_FULL_SCALE = 32768
+
+
+def _is_speech(frame: bytes) -> bool:
+    """Громкость фрейма pcm_s16le выше порога; hypot считает корень из суммы квадратов на C."""
+    samples = array("h", frame)
+    if not samples:
+        return False
+    rms = math.hypot(*samples) / math.sqrt(len(samples))
+    if rms == 0:
+        return False
+    return 20 * math.log10(rms / _FULL_SCALE) > VAD_THRESHOLD_DBFS
+
+
+class TimeMap:
+    """Соответствие времени в обрезанном аудио времени в исходном.
+
+    segments - список пар (начало в обрезанном, начало в исходном) в
+    секундах; внутри сегмента время идёт одинаково.
+    """
+
+    def __init__(self, segments=None):
+        self.segments = segments or [(0.0, 0.0)]
+
+    def to_source(self, t: float) -> float:
+        out_start, src_start = self.segments[0]
+        for out, src in self.segments:
+            if out > t:
+                break
+            out_start, src_start = out, src
+        return src_start + (t - out_start)
+
+    def to_dict(self) -> dict:
+        return {"segments": [[round(o, 3), round(s, 3)] for o, s in self.segments]}
+
+
+def trim_silence(audio_path: str, output_path: str):
+    """Записывает в output_path аудио без длинных пауз.
+
+    Файл обрабатывается потоково, в памяти держится не больше
+    VAD_MIN_SILENCE_SECONDS аудио. Возвращает (TimeMap, секунд вырезано).
+    """
+    with wave.open(audio_path, "rb") as src, wave.open(output_path, "wb") as dst:
+        rate = src.getframerate()
+        if src.getnchannels() != 1 or src.getsampwidth() != 2:
+            raise Exception(
+                f"VAD ожидает моно pcm_s16le, получено: {src.getnchannels()} канал(ов), "
+                f"{src.getsampwidth() * 8} бит"
+            )
+        width = 2
+        dst.setparams(src.getparams())
+
+        frame_samples = rate * VAD_FRAME_MS // 1000
+        pad_frames = max(0, VAD_PADDING_MS // VAD_FRAME_MS)
+        min_silence_frames = max(pad_frames * 2 + 1, int(VAD_MIN_SILENCE_SECONDS * 1000) // VAD_FRAME_MS)
+
+        segments = [(0.0, 0.0)]
+        read = 0  # кадров (сэмплов) прочитано из исходного файла
+        written = 0
+        # Пауза в начале файла вырезается целиком, без поля слева
+        trailing = pad_frames
+        held = []
+        dropping = False
+
+        def write(frames):
+            nonlocal written
+            for f in frames:
+                dst.writeframesraw(f)
+                written += len(f) // width
+
+        while True:
+            frame = src.readframes(frame_samples)
+            if not frame:
+                break
+            read += len(frame) // width
+
+            if _is_speech(frame):
+                if dropping:
+                    # Пауза вырезана: отмечаем, с какого места исходника
+                    # продолжается запись (вместе с левым полем)
+                    kept = sum(len(f) // width for f in held)
+                    source_pos = read - len(frame) // width - kept
+                    segments.append((written / rate, source_pos / rate))
+                write(held)
+                write([frame])
+                held = []
+                dropping = False
+                trailing = 0
+                continue
+
+            if trailing < pad_frames:
+                # Правое поле после речи пишется сразу
+                write([frame])
+                trailing += 1
+                continue
+
+            held.append(frame)
+            if not dropping and len(held) >= min_silence_frames - pad_frames:
+                dropping = True
+            if dropping:
+                held = list(deque(held, maxlen=pad_frames)) if pad_frames else []
+
+        # Хвост: короткая пауза в конце сохраняется, длинная отбрасывается
+        if not dropping:
+            write(held)
+
+        dst.writeframes(b"")
+
+    removed = (read - written) / rate
+    logger.info(
+        f"VAD: вырезано {removed:.1f} с из {read / rate:.1f} с, "
+        f"пауз: {len(segments) - 1}"
+    )
+    return TimeMap(segments), removed
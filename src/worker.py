@@ -1,396 +1,601 @@
 import os
 import json
+import hashlib
 import tempfile
 import subprocess
-import requests
-import boto3
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-from fastapi import FastAPI
-from yandex_cloud_ml_sdk import YCloudML
-from botocore.client import Config
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.units import cm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from botocore.exceptions import ClientError
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from db import update_task, get_task_by_id, logger
+import cache
+import checkpoints
+from clients import get_sqs, get_s3, get_ml_sdk, get_http
+from downloader import download_file, parallel_size
+from links import resolve_download_url
+from db import update_task, get_task_by_id, claim_task, release_task, logger
+from lease import Heartbeat, LEASE_SECONDS, VISIBILITY_TIMEOUT_SECONDS
+from stt import recognize_long_audio
+from summarize import generate_notes
+from tasks_queue import LaneScheduler, LANE_INTERACTIVE, LANE_WEIGHTS, queue_url
+from vad import trim_silence, VAD_ENABLED
+from metrics import TaskTrace, VAD_REMOVED_SECONDS
+from progress import ProgressReporter
+from pdf_render import generate_pdf
 
 app = FastAPI()
 
-print("Worker HTTP service started", flush=True)
-
+# Потоковое извлечение аудио без промежуточного видеофайла
+STREAMING_EXTRACT = os.environ.get("STREAMING_EXTRACT", "1") == "1"
+# Потоки декодирования ffmpeg; 0 - по числу ядер
+FFMPEG_THREADS = os.environ.get("FFMPEG_THREADS", "0")
+# PDF до этого размера рисуется в память, больше - во временный файл
+PDF_SPOOL_MAX_BYTES = int(os.environ.get("PDF_SPOOL_MAX_MB", "16")) * 1024 * 1024
 
-def get_yandex_disk_download_url(public_url: str) -> str:
-    if 'downloader.disk' in public_url or 'download' in public_url.lower():
-        logger.info(f"Using direct download URL: {public_url}")
-        return public_url
-    
-    # Если это 360.yandex.ru - нужно получить download ссылку
-    if '360.yandex' in public_url or 'disk.360.yandex' in public_url:
-        logger.info(f"360.yandex URL detected, extracting download link from page")
-        try:
-            page_response = requests.get(public_url, timeout=10)
-            page_response.raise_for_status()
-            page_html = page_response.text
-            
-            import re
-            download_match = re.search(r'(https://downloader\.disk\.360\.yandex\.[^"\']+)', page_html)
-            if download_match:
-                download_url = download_match.group(1)
-                logger.info(f"Found download URL: {download_url}")
-                return download_url
-            
-            # Альтернативный поиск через data атрибуты
-            data_match = re.search(r'"download":\s*"([^"]+)"', page_html)
-            if data_match:
-                download_url = data_match.group(1).replace('\\/', '/')
-                logger.info(f"Found download URL in data: {download_url}")
-                return download_url
-                
-            raise Exception("Не удалось найти ссылку на скачивание на странице 360.yandex")
-        except Exception as e:
-            raise Exception(f"Ошибка парсинга 360.yandex ссылки: {e}. Используйте прямую ссылку на скачивание.")
-    
-    api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
-    try:
-        response = requests.get(api_url, params={"public_key": public_url}, timeout=10)
-        response.raise_for_status()
-        return response.json()["href"]
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"API failed: {e}")
-        raise Exception(f"Не удалось получить ссылку на скачивание. Используйте прямую ссылку или обычный disk.yandex.ru")
+# Пакетный режим: сколько заданий обрабатывать одновременно и сколько
+# времени есть у одного вызова (execution_timeout контейнера - 600 с)
+MAX_BATCH_SIZE = 10  # ограничение ReceiveMessage
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+TIME_BUDGET_SECONDS = int(os.environ.get("TIME_BUDGET_SECONDS", "540"))
+TASK_TIME_ESTIMATE_SECONDS = int(os.environ.get("TASK_TIME_ESTIMATE_SECONDS", "240"))
 
+# Доли полос interactive/bulk при выборке сообщений, см. tasks_queue
+_lanes = LaneScheduler()
 
-def get_iam_token():
-    """Получить IAM токен через метаданные."""
-    response = requests.get(
-        "http://169.254.169.254/computeMetadata/v1/instance/service-accounts/default/token",
-        headers={"Metadata-Flavor": "Google"}
-    )
-    response.raise_for_status()
-    return response.json()["access_token"]
+# Повторы: после неудачи сообщение возвращается в очередь через
+# RETRY_DELAY_SECONDS, после MAX_ATTEMPTS попыток задание помечается ошибкой
+MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", "3"))
+RETRY_DELAY_SECONDS = int(os.environ.get("RETRY_DELAY_SECONDS", "60"))
 
+print("Worker HTTP service started", flush=True)
 
-def recognize_speech_rest_api(audio_path: str, folder_id: str) -> str:
 
-    iam_token = get_iam_token()
-    
-    # Проверяем размер файла
+def recognize_speech_rest_api(audio_path: str, folder_id: str, on_progress=None) -> str:
     file_size = os.path.getsize(audio_path)
     logger.info(f"Audio file size: {file_size / 1024 / 1024:.2f} MB")
-    
-    # Для коротких аудио (< 1 МБ) используем синхронное API
-    if file_size < 1_000_000:
-        logger.info("Using synchronous STT API for short audio")
-        with open(audio_path, 'rb') as audio_file:
-            audio_data = audio_file.read()
-        
-        response = requests.post(
-            "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize",
-            headers={"Authorization": f"Bearer {iam_token}"},
-            params={
-                "folderId": folder_id,
-                "lang": "ru-RU",
-                "format": "lpcm",
-                "sampleRateHertz": "16000",
-            },
-            data=audio_data,
-            timeout=60
-        )
-        response.raise_for_status()
-        return response.json().get("result", "")
-    
-    logger.info("Audio is too long for sync API, using chunked processing")
-    
-    logger.warning("Processing only first 30 seconds of audio (demo limitation)")
-    
-    # Создаем короткий файл (первые 30 сек)
-    short_audio = tempfile.mktemp(suffix=".wav")
-    subprocess.run([
-        "ffmpeg", "-y", "-i", audio_path,
-        "-t", "30",  # Первые 30 секунд
-        "-acodec", "pcm_s16le",
-        "-ar", "16000",
-        "-ac", "1",
-        short_audio
-    ], check=True, capture_output=True)
-    
-    try:
-        with open(short_audio, 'rb') as audio_file:
-            audio_data = audio_file.read()
-        
-        response = requests.post(
-            "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize",
-            headers={"Authorization": f"Bearer {iam_token}"},
-            params={
-                "folderId": folder_id,
-                "lang": "ru-RU",
-                "format": "lpcm",
-                "sampleRateHertz": "16000",
-            },
-            data=audio_data,
-            timeout=60
-        )
-        response.raise_for_status()
-        result = response.json().get("result", "")
-        return result + "\n\n[Обработана только начальная часть аудио]"
-    finally:
-        if os.path.exists(short_audio):
-            os.remove(short_audio)
+
+    # Синхронное API ограничено 30 секундами, поэтому режем аудио по паузам
+    # и распознаём куски параллельно
+    return recognize_long_audio(audio_path, folder_id, on_progress)
 
 
-def download_video(url: str, output_path: str):
+def download_video(url: str, output_path: str, on_progress=None):
     logger.info(f"Скачивание видео: {url}")
-    response = requests.get(url, stream=True, timeout=300)
-    response.raise_for_status()
-    
-    content_type = response.headers.get('Content-Type', '')
-    logger.info(f"Content-Type: {content_type}")
-    
-    if 'text/html' in content_type:
-        raise Exception(f"URL вернул HTML вместо видео. Возможно, это не прямая ссылка на файл.")
-    
-    total_size = 0
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-                total_size += len(chunk)
-    
+    total_size = download_file(url, output_path, on_progress)
+
     logger.info(f"Видео сохранено: {output_path}, размер: {total_size / 1024 / 1024:.2f} MB")
     
     if total_size < 1000:
         raise Exception(f"Скачанный файл слишком маленький ({total_size} байт). Возможно, ссылка неправильная.")
 
+    return total_size
+
+
+def _extract_audio_cmd(source: str, audio_path: str, input_args=()):
+    """Команда ffmpeg: первая звуковая дорожка -> WAV 16 кГц моно s16le."""
+    return [
+        "ffmpeg", "-y", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-threads", FFMPEG_THREADS,
+        *input_args,
+        "-i", source,
+        # Только звук: видео, субтитры и данные не декодируются
+        "-map", "0:a:0", "-vn", "-sn", "-dn",
+        "-acodec", "pcm_s16le",
+        "-ar", "16000",
+        "-ac", "1",
+        audio_path,
+    ]
+
 
 def extract_audio(video_path: str, audio_path: str):
     logger.info(f"Извлечение аудио из {video_path}")
-    
-    try:
-        probe_result = subprocess.run([
-            "ffmpeg", "-i", video_path
-        ], capture_output=True, text=True)
-        logger.info(f"FFmpeg probe output: {probe_result.stderr[:500]}")
-    except Exception as e:
-        logger.warning(f"Probe failed: {e}")
-    
-    # Извлекаем аудио
-    result = subprocess.run([
-        "ffmpeg", "-y", "-i", video_path,
-        "-vn",  # без видео
-        "-acodec", "pcm_s16le",  # формат аудио
-        "-ar", "16000",  # частота дискретизации
-        "-ac", "1",  # моно
-        audio_path
-    ], capture_output=True, text=True)
-    
+
+    result = subprocess.run(_extract_audio_cmd(video_path, audio_path), capture_output=True, text=True)
+
     if result.returncode != 0:
         logger.error(f"FFmpeg stderr: {result.stderr}")
-        logger.error(f"FFmpeg stdout: {result.stdout}")
         raise Exception(f"FFmpeg failed with code {result.returncode}: {result.stderr[:500]}")
     
     logger.info(f"Аудио сохранено: {audio_path}")
 
 
-def generate_pdf(title: str, notes: str, output_path: str):
+def stream_extract_audio(url: str, audio_path: str):
+    """Извлекает аудио прямо из HTTP-потока, не сохраняя видео на диск.
+
+    ffmpeg сам читает ссылку по HTTP с поддержкой Range-запросов, поэтому
+    скачивание и декодирование идут одновременно, а контейнеры с moov-атомом
+    в конце файла (типичный mp4) тоже обрабатываются.
+    """
+    logger.info(f"Потоковое извлечение аудио: {url}")
+
+    # Быстрая проверка, что по ссылке видео, а не HTML-страница
+    response = get_http().get(url, stream=True, timeout=30)
     try:
-        pdfmetrics.registerFont(TTFont("DejaVuSans", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"))
-        pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"))
-        base_font = "DejaVuSans"
-        title_font = "DejaVuSans-Bold"
-    except Exception as e:
-        logger.warning(f"Не удалось зарегистрировать DejaVuSans шрифты для PDF: {e}")
-        base_font = "Helvetica"
-        title_font = "Helvetica-Bold"
-
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=A4,
-        rightMargin=2*cm,
-        leftMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm
-    )
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontName=title_font,
-        fontSize=18,
-        spaceAfter=30,
-        alignment=1  # центрирование
-    )
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontName=base_font,
-        fontSize=12,
-        leading=16,
-        spaceAfter=12
-    )
-    
-    story = []
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        logger.info(f"Content-Type: {content_type}")
+        if 'text/html' in content_type:
+            raise Exception(f"URL вернул HTML вместо видео. Возможно, это не прямая ссылка на файл.")
+    finally:
+        response.close()
 
-    # Заголовок (название лекции)
-    story.append(Paragraph(title, title_style))
-    story.append(Spacer(1, 20))
+    result = subprocess.run(_extract_audio_cmd(url, audio_path, input_args=[
+        "-reconnect", "1",
+        "-reconnect_streamed", "1",
+        "-reconnect_delay_max", "5",
+    ]), capture_output=True, text=True)
 
-    # Конспект (разбиваем на параграфы)
-    for paragraph in notes.split('\n\n'):
-        if paragraph.strip():
-            story.append(Paragraph(paragraph.strip(), body_style))
-            story.append(Spacer(1, 10))
-    
-    doc.build(story)
-    logger.info(f"PDF создан: {output_path}")
+    if result.returncode != 0:
+        logger.error(f"FFmpeg stderr: {result.stderr}")
+        raise Exception(f"FFmpeg failed with code {result.returncode}: {result.stderr[-500:]}")
 
+    logger.info(f"Аудио сохранено: {audio_path}, размер: {os.path.getsize(audio_path) / 1024 / 1024:.2f} MB")
 
-def process_one_message():
-    logger.info("Processing queue messages...")
-    
-    sqs = boto3.session.Session().client(
-        service_name='sqs',
-        endpoint_url='https://message-queue.api.cloud.yandex.net',
-        region_name='ru-central1',
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
-    )
-    
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://storage.yandexcloud.net',
-        region_name='ru-central1',
-        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        config=Config(signature_version='s3v4')
-    )
 
-    sdk = YCloudML(folder_id=os.environ.get("FOLDER_ID"))
+def _make_clients():
+    return get_sqs(), get_s3(), get_ml_sdk()
+
 
+def _receive_from(sqs, url: str, max_messages: int, wait_seconds: int):
     msgs = sqs.receive_message(
-        QueueUrl=os.environ.get("QUEUE_URL"),
-        MaxNumberOfMessages=1,
-        WaitTimeSeconds=5,
+        QueueUrl=url,
+        MaxNumberOfMessages=max_messages,
+        WaitTimeSeconds=wait_seconds,
+        VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS,
+        AttributeNames=["ApproximateReceiveCount"],
     ).get("Messages", [])
-    
-    if not msgs:
-        logger.info("No messages in queue")
-        return {"status": "no_messages"}
-
+    # Продлевать видимость и удалять сообщение нужно в той очереди, откуда оно пришло
     for m in msgs:
-        task_id = json.loads(m["Body"])["task_id"]
-        video_path = None
-        audio_path = None
-        pdf_path = None
-        
+        m["QueueUrl"] = url
+    return msgs
+
+
+def _receive(sqs, max_messages: int, wait_seconds: int):
+    """Забирает до max_messages сообщений из полос очереди по их весам.
+
+    Места пустой полосы достаются остальным; если пусто везде, ждём
+    сообщений в полосе interactive.
+    """
+    urls = {lane: queue_url(lane) for lane in LANE_WEIGHTS}
+    if len(set(urls.values())) == 1:
+        return _receive_from(sqs, urls[LANE_INTERACTIVE], max_messages, wait_seconds)
+
+    wanted = Counter(_lanes.plan(max_messages))
+    msgs = []
+    for lane, count in wanted.items():
+        msgs += _receive_from(sqs, urls[lane], count, 0)
+    for lane in sorted(urls, key=LANE_WEIGHTS.get, reverse=True):
+        if len(msgs) >= max_messages:
+            break
+        msgs += _receive_from(sqs, urls[lane], max_messages - len(msgs), 0)
+
+    if not msgs and wait_seconds:
+        msgs = _receive_from(sqs, urls[LANE_INTERACTIVE], max_messages, wait_seconds)
+    return msgs
+
+
+def _set_visibility(sqs, m, seconds: int):
+    try:
+        sqs.change_message_visibility(
+            QueueUrl=m["QueueUrl"],
+            ReceiptHandle=m["ReceiptHandle"],
+            VisibilityTimeout=seconds,
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось изменить видимость сообщения: {e}")
+
+
+def _wait_for_task(task_id, attempts=5, delay=1.0):
+    """Web пишет задание в YDB параллельно с отправкой в очередь,
+    поэтому сообщение может прийти чуть раньше строки задания."""
+    for attempt in range(attempts):
+        task = get_task_by_id(task_id)
+        if task or attempt == attempts - 1:
+            return task
+        time.sleep(delay)
+
+
+def _link_cached(task_id, cached):
+    update_task(task_id, status="Успешно завершено", pdf_object_key=cached["pdf_object_key"], error=None)
+    logger.info(f"Задание {task_id} завершено из кэша: {cached['pdf_object_key']}")
+    return {"status": "cached", "task_id": task_id}
+
+
+def _acquire_audio(video_url, audio_path, trace, progress, download_url=None):
+    """Получает аудио лекции; возвращает (путь к видео или None, отпечаток, запись кэша).
+
+    download_url - ссылка на скачивание, разрешённая ещё при создании задания.
+    """
+    video_path = None
+
+    # 1. Проверить и получить прямую ссылку с Яндекс Диска
+    if download_url:
+        logger.info(f"Ссылка для скачивания получена при создании задания: {video_url}")
+    else:
+        logger.info(f"Получение ссылки для скачивания: {video_url}")
+        with trace.span("resolve_url"):
+            download_url = resolve_download_url(video_url)
+
+    # Та же лекция уже обрабатывалась - ссылаемся на готовый PDF
+    fingerprint = None
+    cached = None
+    if cache.CACHE_ENABLED:
+        with trace.span("cache_lookup"):
+            fingerprint = cache.source_fingerprint(video_url, download_url)
+            cached = cache.lookup(fingerprint)
+        if cached:
+            return video_path, fingerprint, cached
+
+    # 2-3. Скачать видео и извлечь аудио. ffmpeg читает ссылку одним
+    # соединением, скорость которого у Диска ограничена, поэтому большой
+    # файл с поддержкой Range выгоднее скачать параллельно и извлечь с диска
+    extracted = False
+    parallel = STREAMING_EXTRACT and parallel_size(download_url)
+    if parallel:
+        logger.info(f"Файл {parallel / 1024 / 1024:.0f} MB качается параллельно вместо потокового извлечения")
+    if STREAMING_EXTRACT and not parallel:
         try:
-            logger.info(f"Обработка задания: {task_id}")
-            update_task(task_id, status="В обработке")
-            
-            task = get_task_by_id(task_id)
-            if not task:
-                raise Exception(f"Задание {task_id} не найдено в БД")
-            
-            title = task.get("title", "Конспект лекции")
-            video_url = task.get("video_url")
-            
-            if not video_url:
-                raise Exception("URL видео не указан")
-            
-            # Создать временные файлы
-            video_path = tempfile.mktemp(suffix=".mp4")
-            audio_path = tempfile.mktemp(suffix=".wav")
-            pdf_path = tempfile.mktemp(suffix=".pdf")
-            
-            # 1. Проверить и получить прямую ссылку с Яндекс Диска
-            logger.info(f"Получение ссылки для скачивания: {video_url}")
-            download_url = get_yandex_disk_download_url(video_url)
-            
-            # 2. Скачать видео
-            download_video(download_url, video_path)
-            
-            # 3. Извлечь аудио
+            progress.report("Извлечение аудио")
+            with trace.span("stream_extract") as span:
+                stream_extract_audio(download_url, audio_path)
+                span.bytes = os.path.getsize(audio_path)
+            extracted = True
+        except Exception as e:
+            logger.warning(f"Потоковое извлечение не удалось: {e}, скачиваем файл целиком")
+
+    if not extracted:
+        video_path = tempfile.mktemp(suffix=".mp4")
+        with trace.span("download") as span:
+            span.bytes = download_video(download_url, video_path, progress.callback("Скачивание видео"))
+        progress.report("Извлечение аудио")
+        with trace.span("extract_audio") as span:
             extract_audio(video_path, audio_path)
-            
-            # 4. Распознать речь через SpeechKit
-            logger.info("Распознавание речи...")
-            
-            # Используем SpeechKit для распознавания аудио
-            with open(audio_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-            
-            try:
-                recognizer = sdk.models.speech_recognition("general")
-                recognized_result = recognizer.transcribe(audio_data)
-                transcript = str(recognized_result)
-            except Exception as stt_error:
-                logger.warning(f"Ошибка SpeechKit SDK: {stt_error}, пробуем REST API")
-                transcript = recognize_speech_rest_api(audio_path, os.environ.get("FOLDER_ID"))
-            
-            logger.info(f"Распознано {len(transcript)} символов")
-            
-            if not transcript or len(transcript) < 50:
-                raise Exception("Не удалось распознать речь из аудио")
-            
-            logger.info("Генерация конспекта...")
-            
-            prompt = f"""Создай структурированный конспект лекции на основе следующего текста.
-            
-Требования к конспекту:
-- Выдели основные темы и подтемы
-- Используй нумерованные и маркированные списки
-- Выдели ключевые определения и термины
-- Добавь краткое резюме в конце
-
-Текст лекции:
-{transcript}"""
-            
-            try:
-                gpt_model = sdk.models.completions("yandexgpt")
-                gpt_model = gpt_model.configure(temperature=0.3)
-                response = gpt_model.run(prompt)
-                notes = str(response.alternatives[0].text)
-            except Exception as gpt_error:
-                logger.warning(f"Ошибка YandexGPT SDK: {gpt_error}, используем транскрипт как конспект")
-                notes = transcript
-            
-            logger.info(f"Конспект сгенерирован: {len(notes)} символов")
-            
+            span.bytes = os.path.getsize(audio_path)
+
+    if cache.CACHE_ENABLED and not fingerprint:
+        fingerprint = cache.audio_fingerprint(audio_path)
+        cached = cache.lookup(fingerprint)
+
+    return video_path, fingerprint, cached
+
+
+def _trim_silence(s3, task_id, audio_path, trace):
+    """Вырезает длинные паузы из аудио перед распознаванием.
+
+    Карта времени сохраняется рядом с PDF, чтобы позиции в расшифровке
+    можно было перевести обратно во время видео.
+    """
+    if not VAD_ENABLED:
+        return
+
+    trimmed_path = audio_path + ".vad.wav"
+    try:
+        with trace.span("vad") as span:
+            span.bytes = os.path.getsize(audio_path)
+            timemap, removed = trim_silence(audio_path, trimmed_path)
+            os.replace(trimmed_path, audio_path)
+        VAD_REMOVED_SECONDS.inc(removed)
+        s3.put_object(
+            Bucket=os.environ["BUCKET_NAME"],
+            Key=f"{task_id}.timemap.json",
+            Body=json.dumps({"removed_seconds": round(removed, 3), **timemap.to_dict()}).encode("utf-8"),
+            ContentType="application/json",
+        )
+    finally:
+        if os.path.exists(trimmed_path):
+            os.remove(trimmed_path)
+
+
+def _transcribe(audio_path, trace, progress) -> str:
+    # 4. Распознать речь через SpeechKit
+    logger.info("Распознавание речи...")
+
+    with trace.span("stt") as span:
+        span.bytes = os.path.getsize(audio_path)
+        # Аудио читается кусками по ходу распознавания, целиком в память не попадает
+        transcript = recognize_speech_rest_api(
+            audio_path, os.environ.get("FOLDER_ID"), progress.callback("Распознавание речи")
+        )
+
+    logger.info(f"Распознано {len(transcript)} символов")
+
+    if not transcript or len(transcript) < 50:
+        raise Exception("Не удалось распознать речь из аудио")
+
+    return transcript
+
+
+def _summarize(sdk, transcript, trace, progress):
+    """Возвращает (конспект, True если YandexGPT не ответил и конспект - сам транскрипт)."""
+    logger.info("Генерация конспекта...")
+    progress.report("Генерация конспекта")
+
+    fallback = False
+    try:
+        with trace.span("gpt") as span:
+            span.bytes = len(transcript.encode("utf-8"))
+            notes = generate_notes(sdk, transcript, progress.callback("Генерация конспекта", "запросов"))
+    except Exception as gpt_error:
+        logger.warning(f"Ошибка YandexGPT SDK: {gpt_error}, используем транскрипт как конспект")
+        notes = transcript
+        fallback = True
+
+    logger.info(f"Конспект сгенерирован: {len(notes)} символов")
+    return notes, fallback
+
+
+def _upload_pdf(s3, buffer):
+    """Загружает PDF под ключом <sha256>.pdf; возвращает (ключ, sha256).
+
+    Одинаковые PDF (например, повторная отрисовка после сбоя) хранятся
+    один раз. upload_fileobj читает буфер частями и большие файлы грузит
+    multipart-загрузкой.
+    """
+    buffer.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: buffer.read(1024 * 1024), b""):
+        digest.update(block)
+    sha256 = digest.hexdigest()
+    key = f"{sha256}.pdf"
+    bucket = os.environ["BUCKET_NAME"]
+
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        logger.info(f"PDF {key} уже есть в бакете, загрузка пропущена")
+        return key, sha256
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            raise
+
+    buffer.seek(0)
+    s3.upload_fileobj(
+        buffer, bucket, key,
+        ExtraArgs={"ContentType": "application/pdf", "Metadata": {"sha256": sha256}},
+    )
+    return key, sha256
+
+
+def process_message(m, sqs, s3, sdk):
+    """Обрабатывает одно сообщение очереди.
+
+    Задание сначала захватывается арендой в YDB, чтобы его не обрабатывали
+    два воркера одновременно; пока оно выполняется, фоновый heartbeat
+    продлевает видимость сообщения и аренду. Сообщение удаляется после
+    успеха или последней неудачной попытки, иначе возвращается в очередь
+    и при повторной доставке задание продолжится с последнего чекпоинта.
+    """
+    task_id = json.loads(m["Body"])["task_id"]
+    attempt = int(m.get("Attributes", {}).get("ApproximateReceiveCount", "1"))
+    owner = uuid.uuid4().hex
+    video_path = None
+    audio_path = None
+    outcome = "error"
+    trace = TaskTrace(task_id, attempt)
+    heartbeat = None
+    progress = None
+    claimed = False
+    delete = True
+    
+    try:
+        logger.info(f"Обработка задания: {task_id} (попытка {attempt})")
+
+        task = _wait_for_task(task_id)
+        if not task:
+            raise Exception(f"Задание {task_id} не найдено в БД")
+
+        claim = claim_task(task_id, owner, LEASE_SECONDS)
+        if claim == "done":
+            logger.info(f"Задание {task_id} уже завершено, дубликат сообщения удаляется")
+            outcome = "duplicate"
+            return {"status": outcome, "task_id": task_id}
+        if claim == "busy":
+            # Задание держит другой воркер; если он упадёт, сообщение
+            # вернётся в очередь, когда истечёт его аренда
+            logger.info(f"Задание {task_id} уже обрабатывается другим воркером")
+            delete = False
+            outcome = "busy"
+            _set_visibility(sqs, m, LEASE_SECONDS)
+            return {"status": outcome, "task_id": task_id}
+        claimed = claim == "claimed"
+
+        heartbeat = Heartbeat(sqs, m["QueueUrl"], m["ReceiptHandle"], task_id, owner).start()
+        progress = ProgressReporter(task_id).start()
+
+        update_task(task_id, status="В обработке")
+        
+        title = task.get("title", "Конспект лекции")
+        video_url = task.get("video_url")
+        
+        if not video_url:
+            raise Exception("URL видео не указан")
+        
+        # Создать временные файлы
+        audio_path = tempfile.mktemp(suffix=".wav")
+
+        # Повторная доставка: продолжаем с последнего завершённого этапа
+        stage = task.get("stage")
+        if stage:
+            logger.info(f"Задание {task_id} продолжается после этапа {stage}")
+
+        fingerprint = None
+        transcript = None
+        notes = None
+        notes_fallback = False
+        # Ключ PDF известен заранее, только если он уже загружен
+        key = task.get("pdf_object_key")
+        done_fields = {}
+
+        # 1-4. Аудио и распознавание речи
+        if not checkpoints.reached(stage, "transcript"):
+            if checkpoints.reached(stage, "audio"):
+                with trace.span("checkpoint_load") as span:
+                    checkpoints.load_audio(task_id, audio_path)
+                    span.bytes = os.path.getsize(audio_path)
+            else:
+                video_path, fingerprint, cached = _acquire_audio(
+                    video_url, audio_path, trace, progress, task.get("download_url")
+                )
+                if cached:
+                    outcome = "cached"
+                    return _link_cached(task_id, cached)
+                # В чекпоинт идёт уже обрезанное аудио
+                progress.report("Удаление пауз")
+                _trim_silence(s3, task_id, audio_path, trace)
+                with trace.span("checkpoint_save"):
+                    checkpoints.save_audio(task_id, audio_path)
+
+            transcript = _transcribe(audio_path, trace, progress)
+            checkpoints.save_text(task_id, "transcript", transcript)
+        elif not checkpoints.reached(stage, "notes"):
+            transcript = checkpoints.load_text(task_id, "transcript")
+
+        # 5. Конспект
+        if not checkpoints.reached(stage, "notes"):
+            notes, notes_fallback = _summarize(sdk, transcript, trace, progress)
+            checkpoints.save_text(task_id, "notes", notes)
+        elif not checkpoints.reached(stage, "pdf"):
+            notes = checkpoints.load_text(task_id, "notes")
+
+        if not checkpoints.reached(stage, "pdf"):
             # 6. Создать PDF
-            generate_pdf(title, notes, pdf_path)
-            
-            # 7. Загрузить PDF в Object Storage
-            key = f"{task_id}.pdf"
-            s3.upload_file(pdf_path, os.environ["BUCKET_NAME"], key)
+            progress.report("Создание PDF")
+            # Небольшой PDF целиком остаётся в памяти, большой уходит во временный файл
+            with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES) as pdf_buffer:
+                with trace.span("pdf") as span:
+                    generate_pdf(title, notes, pdf_buffer)
+                    span.bytes = pdf_buffer.tell()
+
+                # 7. Загрузить PDF в Object Storage
+                with trace.span("upload") as span:
+                    span.bytes = pdf_buffer.tell()
+                    key, done_fields["pdf_sha256"] = _upload_pdf(s3, pdf_buffer)
             logger.info(f"PDF загружен в S3: {key}")
-            
-            # 8. Обновить статус задания
-            update_task(task_id, status="Успешно завершено", pdf_object_key=key)
-            logger.info(f"Задание {task_id} успешно завершено")
+        
+        # 8. Обновить статус задания
+        progress.stop(flush=False)
+        update_task(
+            task_id, status="Успешно завершено", pdf_object_key=key, stage="pdf", progress=None, error=None,
+            **done_fields
+        )
+        logger.info(f"Задание {task_id} успешно завершено")
+        outcome = "processed"
 
-        except Exception as e:
-            logger.error(f"Ошибка обработки задания {task_id}: {e}")
-            update_task(task_id, status="Ошибка", error=str(e))
+        checkpoints.cleanup(task_id)
+        # Транскрипт вместо конспекта в кэш не идёт: иначе повторные
+        # отправки лекции получали бы его вместо нормального конспекта
+        if not notes_fallback:
+            cache.store(fingerprint, transcript, notes, key)
+
+    except Exception as e:
+        logger.error(f"Ошибка обработки задания {task_id} (попытка {attempt}): {e}")
+        # Heartbeat останавливается до смены видимости: иначе очередной
+        # тик вернул бы VISIBILITY_TIMEOUT_SECONDS вместо задержки повтора
+        if heartbeat:
+            heartbeat.stop()
+        if progress:
+            progress.stop(flush=False)
+        if attempt < MAX_ATTEMPTS:
+            # Оставляем сообщение в очереди: повтор продолжит с чекпоинта
+            delete = False
+            outcome = "retry"
+            update_task(task_id, status="В очереди", error=f"Попытка {attempt} не удалась: {e}", progress=None)
+            _set_visibility(sqs, m, RETRY_DELAY_SECONDS)
+        else:
+            update_task(task_id, status="Ошибка", error=str(e), progress=None)
+            # Задание больше не повторится: промежуточные результаты не нужны
+            checkpoints.cleanup(task_id)
+    
+    finally:
+        if progress:
+            progress.stop(flush=False)
+        if heartbeat:
+            heartbeat.stop()
+
+        for path in [video_path, audio_path]:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+
+        if claimed:
+            try:
+                release_task(task_id, owner)
+            except Exception as e:
+                logger.warning(f"Не удалось снять аренду задания {task_id}: {e}")
         
-        finally:
-            for path in [video_path, audio_path, pdf_path]:
-                if path and os.path.exists(path):
-                    try:
-                        os.remove(path)
-                    except Exception:
-                        pass
-            
+        if delete:
             sqs.delete_message(
-                QueueUrl=os.environ.get("QUEUE_URL"),
+                QueueUrl=m["QueueUrl"],
                 ReceiptHandle=m["ReceiptHandle"],
             )
-            
-            return {"status": "processed", "task_id": task_id}
-    
-    return {"status": "no_messages"}
+
+        trace.finish(outcome)
+
+    return {"status": outcome, "task_id": task_id}
+
+
+def process_one_message():
+    logger.info("Processing queue messages...")
+
+    sqs, s3, sdk = _make_clients()
+
+    msgs = _receive(sqs, 1, 5)
+    if not msgs:
+        logger.info("No messages in queue")
+        return {"status": "no_messages"}
+
+    return process_message(msgs[0], sqs, s3, sdk)
+
+
+def process_batch():
+    """Вычитывает до 10 сообщений за раз и обрабатывает их параллельно.
+
+    Новые сообщения берутся, только пока в пуле есть свободные слоты и до
+    конца бюджета времени вызова остаётся не меньше оценки длительности
+    одного задания.
+    """
+    logger.info("Processing queue messages in batch mode...")
+
+    sqs, s3, sdk = _make_clients()
+    deadline = time.monotonic() + TIME_BUDGET_SECONDS
+    results = []
+
+    with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as pool:
+        pending = set()
+        while True:
+            free = WORKER_CONCURRENCY - len(pending)
+            can_take = deadline - time.monotonic() > TASK_TIME_ESTIMATE_SECONDS
+
+            if free > 0 and can_take:
+                # Пока в пуле есть работа, не ждём новые сообщения долго
+                msgs = _receive(sqs, min(MAX_BATCH_SIZE, free), 1 if pending else 5)
+                logger.info(f"Получено сообщений: {len(msgs)}")
+                for m in msgs:
+                    pending.add(pool.submit(process_message, m, sqs, s3, sdk))
+                if not msgs and not pending:
+                    break
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error(f"Ошибка в пакетной обработке: {e}")
+                    results.append({"status": "error", "error": str(e)})
+
+    if not results:
+        logger.info("No messages in queue")
+        return {"status": "no_messages"}
+
+    return {"status": "processed", "tasks": results}
 
 
 @app.get("/")
@@ -399,11 +604,16 @@ def health_check():
     return {"status": "healthy", "service": "lecture-notes-worker"}
 
 
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/")
 @app.post("/process")
 def process_queue():
     try:
-        result = process_one_message()
+        result = process_batch()
         return result
     except Exception as e:
         logger.error(f"Error processing queue: {e}")
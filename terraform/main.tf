@@ -82,6 +82,13 @@ resource "yandex_message_queue" "queue" {
   secret_key = yandex_iam_service_account_static_access_key.sa_static_key.secret_key
 }
 
+# Полоса для массовых загрузок и длинных лекций
+resource "yandex_message_queue" "queue_bulk" {
+  name       = "${var.prefix}-queue-bulk"
+  access_key = yandex_iam_service_account_static_access_key.sa_static_key.access_key
+  secret_key = yandex_iam_service_account_static_access_key.sa_static_key.secret_key
+}
+
 # --------------------
 # Object Storage
 # --------------------
@@ -111,6 +118,7 @@ resource "yandex_serverless_container" "web" {
       YDB_ENDPOINT          = yandex_ydb_database_serverless.ydb.ydb_api_endpoint
       YDB_DATABASE          = yandex_ydb_database_serverless.ydb.database_path
       QUEUE_URL             = yandex_message_queue.queue.id
+      QUEUE_URL_BULK        = yandex_message_queue.queue_bulk.id
       FOLDER_ID             = var.folder_id
       BUCKET_NAME           = yandex_storage_bucket.bucket.bucket
       AWS_ACCESS_KEY_ID     = yandex_iam_service_account_static_access_key.sa_static_key.access_key
@@ -130,6 +138,7 @@ resource "yandex_serverless_container" "worker" {
       YDB_ENDPOINT          = yandex_ydb_database_serverless.ydb.ydb_api_endpoint
       YDB_DATABASE          = yandex_ydb_database_serverless.ydb.database_path
       QUEUE_URL             = yandex_message_queue.queue.id
+      QUEUE_URL_BULK        = yandex_message_queue.queue_bulk.id
       FOLDER_ID             = var.folder_id
       BUCKET_NAME           = yandex_storage_bucket.bucket.bucket
       AWS_ACCESS_KEY_ID     = yandex_iam_service_account_static_access_key.sa_static_key.access_key
@@ -163,11 +172,17 @@ resource "yandex_function" "worker_invoker" {
   runtime            = "python312"
   entrypoint         = "index.handler"
   memory             = "128"
-  execution_timeout  = "600"  # 10 минут - достаточно для обработки задания
+  execution_timeout  = "60"  # воркеры вызываются без ожидания окончания обработки
   service_account_id = yandex_iam_service_account.sa.id
 
   environment = {
-    CONTAINER_ID = yandex_serverless_container.worker.id
+    CONTAINER_ID            = yandex_serverless_container.worker.id
+    QUEUE_URL               = yandex_message_queue.queue.id
+    QUEUE_URL_BULK          = yandex_message_queue.queue_bulk.id
+    AWS_ACCESS_KEY_ID       = yandex_iam_service_account_static_access_key.sa_static_key.access_key
+    AWS_SECRET_ACCESS_KEY   = yandex_iam_service_account_static_access_key.sa_static_key.secret_key
+    MAX_INVOCATIONS         = var.worker_max_invocations
+    MESSAGES_PER_INVOCATION = var.worker_messages_per_invocation
   }
 
   user_hash = data.archive_file.worker_invoker.output_base64sha256
@@ -15,3 +15,15 @@ variable "yc_token" {
 variable "prefix" {
   type = string
 }
+
+variable "worker_max_invocations" {
+  description = "Максимум параллельных вызовов воркера за один тик таймера"
+  type        = number
+  default     = 20
+}
+
+variable "worker_messages_per_invocation" {
+  description = "Сколько сообщений очереди приходится на один вызов воркера"
+  type        = number
+  default     = 4
+}
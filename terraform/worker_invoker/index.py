@@ -1,46 +1,92 @@
 import os
 import json
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 
-def handler(event, context):
-    """Вызывает worker контейнер через HTTP."""
+# Сколько сообщений в среднем разбирает один вызов воркера и сколько
+# вызовов можно запустить за один тик таймера
+MESSAGES_PER_INVOCATION = int(os.environ.get('MESSAGES_PER_INVOCATION', '4'))
+MAX_INVOCATIONS = int(os.environ.get('MAX_INVOCATIONS', '20'))
+# Ответа воркера не ждём: достаточно, чтобы запрос дошёл до контейнера
+DISPATCH_TIMEOUT = float(os.environ.get('DISPATCH_TIMEOUT', '3'))
+
+
+def get_queue_depth():
+    """Примерное число сообщений, ожидающих обработки, во всех полосах."""
+    import boto3
+
+    sqs = boto3.session.Session().client(
+        service_name='sqs',
+        endpoint_url='https://message-queue.api.cloud.yandex.net',
+        region_name='ru-central1',
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
+    )
+    urls = {os.environ['QUEUE_URL'], os.environ.get('QUEUE_URL_BULK') or os.environ['QUEUE_URL']}
+    depth = 0
+    for url in urls:
+        attributes = sqs.get_queue_attributes(
+            QueueUrl=url,
+            AttributeNames=['ApproximateNumberOfMessages'],
+        )['Attributes']
+        depth += int(attributes.get('ApproximateNumberOfMessages', 0))
+    return depth
+
+
+def invocations_for(depth):
+    if depth <= 0:
+        return 0
+    return min(MAX_INVOCATIONS, math.ceil(depth / MESSAGES_PER_INVOCATION))
+
+
+def dispatch(url):
+    """Отправляет POST воркеру и не дожидается окончания обработки.
+
+    Таймаут чтения означает, что запрос принят и воркер работает: обработчик
+    контейнера продолжает выполнение и после разрыва соединения.
+    """
     import requests
-    
+
+    try:
+        response = requests.post(url, timeout=(DISPATCH_TIMEOUT, DISPATCH_TIMEOUT), json={})
+        return f"completed: {response.status_code}"
+    except requests.exceptions.ReadTimeout:
+        return "dispatched"
+    except requests.exceptions.RequestException as e:
+        return f"error: {e}"
+
+
+def handler(event, context):
+    """Вызывает worker контейнер через HTTP пропорционально длине очереди."""
     container_id = os.environ['CONTAINER_ID']
-    
+
     # Правильный URL для вызова Serverless Container
     # Формат: https://<container_id>.containers.yandexcloud.net/
     url = f'https://{container_id}.containers.yandexcloud.net/'
-    
+
     print(f"Invoking worker container: {url}")
     print(f"Container ID: {container_id}")
-    
+
     try:
-        # Вызываем контейнер (POST для обработки)
-        print("Sending POST request...")
-        response = requests.post(url, timeout=600, json={})
-        
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text[:500]}")  # Первые 500 символов
-        
-        return {
-            'statusCode': response.status_code,
-            'body': response.text
-        }
-    except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout calling container: {str(e)}"
-        print(error_msg)
-        return {
-            'statusCode': 504,
-            'body': json.dumps({'error': error_msg})
-        }
-    except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error: {str(e)}"
-        print(error_msg)
+        depth = get_queue_depth()
+    except Exception as e:
+        # Без длины очереди ведём себя как раньше: один вызов за тик
+        print(f"Failed to read queue depth: {e}")
+        depth = MESSAGES_PER_INVOCATION
+
+    count = invocations_for(depth)
+    print(f"Queue depth: {depth}, invocations: {count}")
+
+    if count == 0:
         return {
-            'statusCode': 503,
-            'body': json.dumps({'error': error_msg})
+            'statusCode': 200,
+            'body': json.dumps({'queue_depth': depth, 'invocations': 0})
         }
+
+    try:
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            results = list(pool.map(dispatch, [url] * count))
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         print(error_msg)
@@ -49,3 +95,9 @@ def handler(event, context):
             'body': json.dumps({'error': error_msg})
         }
 
+    print(f"Dispatch results: {results}")
+    failed = sum(1 for r in results if r.startswith('error'))
+    return {
+        'statusCode': 503 if failed == count else 200,
+        'body': json.dumps({'queue_depth': depth, 'invocations': count, 'results': results})
+    }